@@ -0,0 +1,204 @@
+"""Pack sprites of any size into a single, near-square power-of-two sheet.
+
+    Placement uses a bottom-left skyline: the packed area is tracked as a list
+    of horizontal segments, and each sprite goes where its top edge ends up
+    lowest. The sprites are expected to carry their own 1px clear border.
+"""
+
+#std lib
+import json
+from math import ceil, sqrt
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+#3rd party
+import numpy
+from PIL import Image
+
+#custom
+from constants import Box
+from dedupe import find_duplicates
+from worker import Job
+from writer import save_png, write_bands
+
+
+#sheets with more pixels than this are written band by band
+STREAM_PIXELS = 4096 * 4096
+#rows per band when a sheet is written band by band
+BAND_ROWS = 256
+
+
+def atlas_bands(images: List[Image], size: Tuple[int, int], boxes: List[Box], rows: int = BAND_ROWS) -> Iterator[Image]:
+    """Yield the packed sheet as bands of rows, top to bottom."""
+    width, height = size
+    tops = numpy.array([box.y1 for box in boxes])
+    bottoms = numpy.array([box.y2 for box in boxes])
+    for top in range(0, height, rows):
+        bottom = min(top + rows, height)
+        color = (0, 0, 0, 0) #transparent
+        band = Image.new("RGBA", (width, bottom - top), color)
+        #only the sprites that cross the band, cut off by its edges
+        for index in numpy.flatnonzero((tops < bottom) & (bottoms > top)):
+            band.paste(_rgba(images[index]), (boxes[index].x1, boxes[index].y1 - top))
+        yield band
+
+
+def build_atlas(images: List[Image]) -> Tuple[Image, List[Box]]:
+    """Paste the images into a packed sheet and return it with each image's box."""
+    size, boxes = pack([(image.width, image.height) for image in images])
+    color = (0, 0, 0, 0) #transparent
+    final_image = Image.new("RGBA", size, color)
+    for image, box in zip(images, boxes):
+        final_image.paste(_rgba(image), (box.x1, box.y1))
+    return final_image, boxes
+
+
+def metadata(path: Path, size: Tuple[int, int], boxes: List[Box], aliases: Optional[List[int]] = None) -> dict:
+    """Return the description of every sprite's rectangle in the sheet.
+
+        aliases: for each sprite, the index of the sprite whose rectangle it
+        shares. Duplicates get an "alias" entry naming it.
+    """
+    frames = []
+    for index, box in enumerate(boxes):
+        frame = {
+            "index": index,
+            "x": box.x1,
+            "y": box.y1,
+            "w": box.x2 - box.x1,
+            "h": box.y2 - box.y1}
+        if aliases is not None and aliases[index] != index:
+            frame["alias"] = aliases[index]
+        frames.append(frame)
+    return {"image": Path(path).name, "size": list(size), "frames": frames}
+
+
+def next_power_of_two(value: int) -> int:
+    """Return the smallest power of two that is at least value."""
+    return 1 << max(value - 1, 0).bit_length()
+
+
+def pack(sizes: List[Tuple[int, int]]) -> Tuple[Tuple[int, int], List[Box]]:
+    """Return the sheet size and a box for each (width, height), in the order given."""
+    if not sizes:
+        return (0, 0), []
+    widest = next_power_of_two(max(width for width, _ in sizes))
+    area = sum(width * height for width, height in sizes)
+    side = max(next_power_of_two(ceil(sqrt(area))), widest)
+
+    #tallest first, then the one that needs the least space wins
+    order = sorted(range(len(sizes)), key=lambda index: (-sizes[index][1], -sizes[index][0]))
+    best = None
+    for width in {max(side // 2, widest), side, side * 2}:
+        height, positions = _skyline(width, [sizes[index] for index in order])
+        sheet = (width, next_power_of_two(height))
+        score = (sheet[0] * sheet[1], abs(sheet[0] - sheet[1]))
+        if best is None or score < best[0]:
+            best = (score, sheet, positions)
+
+    _, sheet, positions = best
+    boxes = [None] * len(sizes)
+    for index, (x, y) in zip(order, positions):
+        width, height = sizes[index]
+        boxes[index] = Box(x, y, x + width, y + height)
+    return sheet, boxes
+
+
+def write_atlas(images: List[Image],
+                path: Path,
+                preset: str = "default",
+                dedupe: bool = True,
+                near: Optional[int] = None,
+                job: Optional[Job] = None) -> Tuple[Tuple[int, int], List[Box]]:
+    """Save the packed sheet to path and its metadata next to it as JSON.
+
+        preset is one of writer.PRESETS. Sheets over STREAM_PIXELS are never
+        built whole, they are packed and written a band at a time.
+        With dedupe, identical sprites, or near identical ones when near is
+        given, are stored once and the copies point at it in the metadata.
+        With a job, each band or pasted sprite is a step of it, and a
+        cancelled job stops before the sheet is written.
+        Returns the sheet's size and each image's box.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    aliases = find_duplicates(images, near) if dedupe else list(range(len(images)))
+    #only the first of each set of duplicates is packed
+    unique = [index for index, alias in enumerate(aliases) if alias == index]
+    unique_images = [images[index] for index in unique]
+    size, unique_boxes = pack([(image.width, image.height) for image in unique_images])
+    placed = dict(zip(unique, unique_boxes))
+    boxes = [placed[alias] for alias in aliases]
+
+    streamed = size[0] * size[1] > STREAM_PIXELS
+    if job is not None:
+        job.total = -(-size[1] // BAND_ROWS) if streamed else len(unique_images) + 1
+    if streamed:
+        write_bands(path, size, atlas_bands(unique_images, size, unique_boxes), preset, job)
+    else:
+        final_image = Image.new("RGBA", size, (0, 0, 0, 0))
+        for image, box in zip(unique_images, unique_boxes):
+            final_image.paste(_rgba(image), (box.x1, box.y1))
+            if job is not None:
+                job.advance()
+        save_png(final_image, path, preset, job)
+    with open(path.with_suffix(".json"), "w") as output:
+        json.dump(metadata(path, size, boxes, aliases), output, indent=1)
+    return size, boxes
+
+
+def _rgba(image: Image) -> Image:
+    """Return the image as RGBA, palette sprites are only expanded where they are written."""
+    if image.mode != "RGBA":
+        return image.convert("RGBA")
+    return image
+
+
+def _skyline(width: int, sizes: List[Tuple[int, int]]) -> Tuple[int, List[Tuple[int, int]]]:
+    """Place each size bottom-left on a skyline of the given width.
+
+        Returns the height used and the (x, y) of every size.
+    """
+    #each segment is [x, y, width], left to right, covering the whole sheet width
+    skyline = [[0, 0, width]]
+    positions = []
+    used = 0
+    for w, h in sizes:
+        best_y = best_x = best_index = None
+        for index, (x, _, _) in enumerate(skyline):
+            if x + w > width:
+                break
+            #the lowest y the sprite can sit at over the segments it spans
+            y = 0
+            right = x + w
+            span = index
+            while span < len(skyline) and skyline[span][0] < right:
+                y = max(y, skyline[span][1])
+                span += 1
+            if best_y is None or y + h < best_y + h:
+                best_y, best_x, best_index = y, x, index
+
+        positions.append((best_x, best_y))
+        used = max(used, best_y + h)
+        _raise(skyline, best_index, best_x, best_y + h, w)
+    return used, positions
+
+
+def _raise(skyline: List[List[int]], index: int, x: int, top: int, w: int) -> None:
+    """Lift the skyline to top between x and x + w."""
+    right = x + w
+    #drop or trim the segments the new one covers
+    end = index
+    while end < len(skyline) and skyline[end][0] + skyline[end][2] <= right:
+        end += 1
+    if end < len(skyline) and skyline[end][0] < right:
+        segment = skyline[end]
+        segment[2] -= right - segment[0]
+        segment[0] = right
+    skyline[index:end] = [[x, top, w]]
+
+    #merge neighbours at the same height
+    if index + 1 < len(skyline) and skyline[index + 1][1] == top:
+        skyline[index][2] += skyline.pop(index + 1)[2]
+    if index > 0 and skyline[index - 1][1] == top:
+        skyline[index - 1][2] += skyline.pop(index)[2]
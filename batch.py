@@ -0,0 +1,211 @@
+"""Extract sprites from a sheet without opening a window.
+
+    Usage:
+        python3 batch.py <spritesheet.png> <manifest.json|manifest.csv> <output.png>
+
+    The sprites are packed into output.png and their rectangles are written
+    to output.json. With --cache <dir> extracted sprites are kept in dir and
+    reused by later runs on the same sheet. --png fast|default|max trades
+    file size for writing speed, and --sprites <dir> also writes every
+    sprite to its own file, several at a time. Identical sprites are stored
+    once in output.png, their frames in output.json get an "alias" naming
+    the first one, and --near 1-3 merges near identical sprites too.
+
+    The manifest lists the boxes to extract in the sheet's pixel coordinates
+    (origin at the top-left corner, right and bottom edges excluded) and the
+    primary and secondary colors to use for each of them. Either may be a
+    list of colors. "tolerance" lets nearby colors match too, per channel, or
+    as a distance when "metric" is "euclidean".
+
+    JSON manifest:
+        {
+            "primary": [0, 128, 128],
+            "secondary": ["#ffffff", "#f8f8f8"],
+            "tolerance": 2,
+            "regions": [
+                [8, 8, 40, 40],
+                {"box": [48, 8, 80, 40], "secondary": [200, 200, 200], "tolerance": 0}
+            ]
+        }
+
+    A JSON manifest can also, or instead, describe a grid of equal cells.
+    Every cell is extracted, in one pass over the sheet:
+        "grid": {"columns": 8, "rows": 4, "width": 32, "height": 32, "left": 0, "top": 0, "spacing": 2}
+    or the grid that fits the sheet with cells like this one:
+        "grid": {"cell": [0, 0, 32, 32], "spacing": 2}
+
+    CSV manifest, one region per row (secondary and tolerance may be left
+    empty, several colors are separated by ";"):
+        x1,y1,x2,y2,primary,secondary,tolerance
+        8,8,40,40,#008080,#ffffff;#f8f8f8,2
+"""
+
+#std lib
+import argparse
+import csv
+import json
+from pathlib import Path
+import sys
+from time import perf_counter
+from typing import Callable, List, Optional, Tuple
+
+#3rd party
+from PIL import Image
+
+#custom
+from atlas import write_atlas
+from cache import SpriteCache, file_digest
+from constants import Box, Region, parse_color
+from grid import Grid, extract_grid, grid_from_cell
+from masks import KeySet
+from pipeline import extract_regions
+from writer import PRESETS, save_many
+
+
+def parse_keys(value, tolerance=0, metric: str = "channel") -> Optional[KeySet]:
+    """Turn one color, or a list of them, into a KeySet."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        colors = [parse_color(color) for color in value.split(";") if color.strip()]
+    elif value and isinstance(value[0], (list, tuple, str)):
+        colors = [parse_color(color) for color in value]
+    else:
+        colors = [parse_color(value)]
+    return KeySet(colors, tolerance, metric)
+
+
+def _shared_keys() -> Callable:
+    """Return parse_keys that hands back the same KeySet for the same arguments.
+
+        Each KeySet compiles its own lookup table, so regions that use the
+        same colors should share one.
+    """
+    parsed = {}
+    def parse(value, tolerance=0, metric: str = "channel") -> Optional[KeySet]:
+        arguments = (json.dumps(value), json.dumps(tolerance), metric)
+        if arguments not in parsed:
+            parsed[arguments] = parse_keys(value, tolerance, metric)
+        return parsed[arguments]
+    return parse
+
+
+def load_manifest(path: Path) -> List[Region]:
+    """Read the regions from a JSON or CSV manifest."""
+    if path.suffix.lower() == ".csv":
+        return _load_csv(path)
+    return _load_json(path)
+
+
+def _load_csv(path: Path) -> List[Region]:
+    """Read the regions from a CSV manifest."""
+    regions = []
+    parse = _shared_keys()
+    with open(path, newline="") as manifest:
+        #the header is line 1
+        for line, row in enumerate(csv.DictReader(manifest), 2):
+            box = Box(*(int(row[edge]) for edge in Box._fields))
+            tolerance = int(row.get("tolerance") or 0)
+            primary = parse(row.get("primary"), tolerance)
+            if primary is None:
+                raise ValueError(f"{path}: line {line} has no primary color")
+            regions.append(Region(box, primary, parse(row.get("secondary"), tolerance)))
+    return regions
+
+
+def _load_json(path: Path) -> List[Region]:
+    """Read the regions from a JSON manifest."""
+    with open(path) as manifest:
+        data = json.load(manifest)
+    primary = data.get("primary")
+    secondary = data.get("secondary")
+    tolerance = data.get("tolerance", 0)
+    metric = data.get("metric", "channel")
+
+    regions = []
+    parse = _shared_keys()
+    for number, entry in enumerate(data.get("regions", [])):
+        if not isinstance(entry, dict):
+            entry = {"box": entry}
+        box = Box(*entry["box"])
+        keys = (entry.get("tolerance", tolerance), entry.get("metric", metric))
+        region_primary = parse(entry.get("primary", primary), *keys)
+        if region_primary is None:
+            raise ValueError(f"{path}: region {number} {list(box)} has no primary color")
+        regions.append(Region(box, region_primary, parse(entry.get("secondary", secondary), *keys)))
+    return regions
+
+
+def load_grid(path: Path, size: Tuple[int, int]) -> Optional[Tuple[Grid, KeySet, Optional[KeySet]]]:
+    """Read the grid and its colors from a JSON manifest, None if it has no grid."""
+    if path.suffix.lower() == ".csv":
+        return None
+    with open(path) as manifest:
+        data = json.load(manifest)
+    spec = data.get("grid")
+    if spec is None:
+        return None
+    if "cell" in spec:
+        grid = grid_from_cell(size, Box(*spec["cell"]), spec.get("spacing", 0))
+    else:
+        grid = Grid(
+            spec["columns"],
+            spec["rows"],
+            spec["width"],
+            spec["height"],
+            spec.get("left", 0),
+            spec.get("top", 0),
+            spec.get("spacing", 0))
+    keys = (data.get("tolerance", 0), data.get("metric", "channel"))
+    primary = parse_keys(data.get("primary"), *keys)
+    if primary is None:
+        raise ValueError(f"{path}: the grid has no primary color")
+    return grid, primary, parse_keys(data.get("secondary"), *keys)
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="Extract sprites from a sheet without opening a window.")
+    parser.add_argument("sheet", type=Path, help="sprite sheet to extract from")
+    parser.add_argument("manifest", type=Path, help="JSON or CSV list of boxes and colors")
+    parser.add_argument("output", type=Path, help="where to write the extracted sprite sheet")
+    parser.add_argument("--cache", type=Path, help="directory to keep extracted sprites in between runs")
+    parser.add_argument("--png", choices=sorted(PRESETS), default="default", help="PNG speed versus size")
+    parser.add_argument("--sprites", type=Path, help="also save each sprite to its own PNG in this directory")
+    parser.add_argument("--keep-duplicates", action="store_true", help="store identical sprites more than once")
+    parser.add_argument("--near", type=int, choices=range(4), help="also merge sprites whose hashes differ in this many bits")
+    args = parser.parse_args(argv)
+
+    sheet = Image.open(args.sheet)
+    try:
+        regions = load_manifest(args.manifest)
+        grid = load_grid(args.manifest, sheet.size)
+    except ValueError as error:
+        print(error)
+        return 1
+    start = perf_counter()
+    cache = SpriteCache(file_digest(args.sheet), directory=args.cache) if args.cache else None
+    sprites = extract_regions(sheet, regions, cache)
+    if grid is not None:
+        sprites += extract_grid(sheet, *grid)
+    sprites = [sprite for sprite in sprites if sprite is not None]
+    elapsed = perf_counter() - start
+    rate = len(sprites) / elapsed if elapsed else float("inf")
+    print(f"{args.sheet}: extracted {len(sprites)} sprites in {elapsed:.3f}s ({rate:.1f} sprites/s)")
+    if cache is not None:
+        stats = cache.stats()
+        print(f"cache: {stats['hits'] + stats['disk_hits']} hits, {stats['misses']} misses")
+
+    if not sprites:
+        print("There are no images to save.")
+        return 1
+    start = perf_counter()
+    write_atlas(sprites, args.output, args.png, not args.keep_duplicates, args.near)
+    if args.sprites:
+        paths = [args.sprites / f"{index}.png" for index in range(len(sprites))]
+        save_many(sprites, paths, args.png)
+    print(f"written in {perf_counter() - start:.3f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,180 @@
+"""Time each step of the extraction pipeline, without opening a window.
+
+    Runs on every sheet in resources/ and on generated sheets of growing
+    size, and writes the timings as JSON. Given an earlier result with
+    --compare, it fails when a step got slower than the threshold allows.
+
+    Usage:
+        python3 benchmark.py [--output benchmark.json] [--compare baseline.json] [--threshold 0.25]
+
+    Run it from the repository's root so resources/ is found.
+
+    Steps:
+        load      decode the sheet, as SpriteSheet.__init__ does
+        detect    find the sprites on the sheet
+        slice     cut every sprite's box out of the sheet
+        mask      primary color mask of every slice
+        crop      tight box around each mask
+        key       key the secondary color out of every sprite in one batch
+        extract   the whole slice, mask, crop, key and border pipeline
+        texture   pyglet image data for every sprite, skipped without pyglet
+        atlas     pack the sprites and write the sheet, as w does
+"""
+
+#std lib
+import argparse
+import json
+from pathlib import Path
+import platform
+from statistics import median
+import sys
+import tempfile
+from time import perf_counter
+from typing import Callable, Dict, List, Tuple
+
+#3rd party
+import numpy
+import PIL
+from PIL import Image
+
+#custom
+from atlas import write_atlas
+from colors import pack, ranked
+from constants import Region
+from detect import detect_sprites
+from keying import remove_color_batch
+from masks import KeySet, bounding_box, primary_mask
+from pipeline import add_border, extract_regions, load_sheet, slice_sheet
+
+
+def synthetic_sheet(size: int, seed: int = 0) -> Image:
+    """Return a size x size sheet of outlined sprites on a plain background."""
+    random = numpy.random.default_rng(seed)
+    pixels = numpy.empty((size, size, 3), dtype=numpy.uint8)
+    pixels[:] = (0, 128, 128)
+    cell = 48
+    for top in range(4, size - cell, cell):
+        for left in range(4, size - cell, cell):
+            width, height = random.integers(12, cell - 8, size=2)
+            pixels[top:top + height, left:left + width] = (255, 255, 255)
+            pixels[top + 1:top + height - 1, left + 1:left + width - 1] = random.integers(0, 200, size=3)
+    return Image.fromarray(pixels)
+
+
+def timed(function: Callable, repeat: int) -> Tuple[float, float]:
+    """Return the median and the fastest time of calling function repeat times."""
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        function()
+        times.append(perf_counter() - start)
+    return median(times), min(times)
+
+
+def bench_sheet(path: Path, repeat: int) -> Dict[str, dict]:
+    """Time every step on one sheet."""
+    results = {}
+    def record(step, function):
+        middle, fastest = timed(function, repeat)
+        results[step] = {"median": middle, "min": fastest, "runs": repeat}
+
+    record("load", lambda: load_sheet(path))
+    sheet = load_sheet(path)
+
+    #the most common color is taken for the background, the next one is keyed out
+    top = ranked(pack(sheet))[:2]
+    primary = KeySet([top[0][0]])
+    secondary = KeySet([top[-1][0]])
+
+    record("detect", lambda: detect_sprites(sheet, primary))
+    boxes = detect_sprites(sheet, primary)
+    slices = [slice_sheet(sheet, box) for box in boxes]
+    masks = [primary_mask(image, primary) for image in slices]
+    crops = [image.crop(bounding_box(mask)) for image, mask in zip(slices, masks)]
+    sprites = [add_border(sprite) for sprite in remove_color_batch(crops, secondary)]
+    regions = [Region(box, primary, secondary) for box in boxes]
+
+    record("slice", lambda: [slice_sheet(sheet, box) for box in boxes])
+    record("mask", lambda: [primary_mask(image, primary) for image in slices])
+    record("crop", lambda: [image.crop(bounding_box(mask)) for image, mask in zip(slices, masks)])
+    record("key", lambda: remove_color_batch(crops, secondary))
+    record("extract", lambda: extract_regions(sheet, regions))
+    try:
+        import pyglet
+        pyglet.options["shadow_window"] = False
+        from textures import image_data
+        record("texture", lambda: [image_data(sprite) for sprite in sprites])
+    except ImportError:
+        pass
+    with tempfile.TemporaryDirectory() as directory:
+        record("atlas", lambda: write_atlas(sprites, Path(directory) / "atlas.png"))
+
+    for result in results.values():
+        result["sprites"] = len(boxes)
+    return results
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float, floor: float) -> List[str]:
+    """Return a line for every step that is slower than baseline by more than threshold.
+
+        The fastest runs are compared, they are the least noisy, and steps
+        that got slower by less than floor seconds are ignored.
+    """
+    slower = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None or not before["min"]:
+            continue
+        change = result["min"] / before["min"] - 1
+        if change > threshold and result["min"] - before["min"] > floor:
+            slower.append(f"{name}: {before['min']:.4f}s -> {result['min']:.4f}s (+{change:.0%})")
+    return slower
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="Time each step of the extraction pipeline.")
+    parser.add_argument("--output", type=Path, default=Path("benchmark.json"), help="where to write the results")
+    parser.add_argument("--compare", type=Path, help="earlier results to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown, 0.25 is 25%%")
+    parser.add_argument("--floor", type=float, default=0.002, help="ignore slowdowns of fewer seconds than this")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per step, the median is kept")
+    parser.add_argument("--sizes", type=int, nargs="*", default=[512, 1024, 2048, 4096], help="generated sheet sizes")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        sheets = sorted(Path("resources").glob("*.png"))
+        for size in args.sizes:
+            path = Path(directory) / f"synthetic{size}.png"
+            synthetic_sheet(size).save(path, compress_level=1)
+            sheets.append(path)
+
+        results = {}
+        for path in sheets:
+            for step, result in bench_sheet(path, args.repeat).items():
+                name = f"{path.stem}:{step}"
+                results[name] = result
+                print(f"{name:32} {result['median']:.4f}s  ({result['sprites']} sprites)")
+
+    output = {
+        "python": platform.python_version(),
+        "pillow": PIL.__version__,
+        "numpy": numpy.__version__,
+        "machine": platform.machine(),
+        "results": results}
+    with open(args.output, "w") as destination:
+        json.dump(output, destination, indent=1)
+
+    if args.compare:
+        with open(args.compare) as source:
+            baseline = json.load(source)["results"]
+        slower = compare(results, baseline, args.threshold, args.floor)
+        for line in slower:
+            print(f"slower: {line}")
+        if slower:
+            return 1
+        print(f"No step is more than {args.threshold:.0%} slower than {args.compare}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,176 @@
+"""Remember extracted sprites so the same region is only extracted once.
+
+    A sprite is found by a key made from the sheet's content hash, the box
+    and the key colors, so a cached sprite can't outlive the pixels it came
+    from. Recently used sprites are kept in memory up to a byte budget, and
+    every sprite can also be written to a directory to survive restarts. The
+    directory has its own budget, the least recently used files go first.
+"""
+
+#std lib
+from collections import OrderedDict
+import hashlib
+from pathlib import Path
+import threading
+from typing import Optional, Set, Union
+
+#3rd party
+from PIL import Image
+
+#custom
+from constants import Box, Color
+from history import image_bytes
+from masks import KeySet, key_set
+
+#stands in for a region with nothing in it, which is worth remembering too
+EMPTY = object()
+
+
+def file_digest(path: Path) -> str:
+    """Return the sha256 of the file's bytes."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as source:
+        for chunk in iter(lambda: source.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _delete(path: Path) -> None:
+    """Delete the file if it is still there."""
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+
+
+class SpriteCache():
+    """Extracted sprites by sheet, box and key colors, in memory and optionally on disk."""
+    def __init__(self,
+                 digest: str,
+                 max_bytes: int = 64 * 1024 * 1024,
+                 directory: Optional[Path] = None,
+                 max_disk_bytes: int = 512 * 1024 * 1024):
+        self.digest = digest
+        self.max_bytes = max_bytes
+        self.directory = Path(directory) if directory is not None else None
+        self.max_disk_bytes = max_disk_bytes
+        self.sprites = OrderedDict()
+        self.bytes = 0
+
+        #path -> size of the files on disk, least recently used first
+        self.files = OrderedDict()
+        self.disk_bytes = 0
+        if self.directory is not None and self.directory.exists():
+            paths = sorted(self.directory.glob("*/*.png"), key=lambda path: path.stat().st_mtime)
+            for path in paths:
+                self.files[path] = path.stat().st_size
+                self.disk_bytes += self.files[path]
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.sprites)
+
+    def key(self, box: Box, primary: Union[Color, KeySet], secondary: Union[Color, KeySet, None]) -> str:
+        """Return the key for a region of this sheet."""
+        secondary = key_set(secondary).keys if secondary is not None else None
+        text = f"{self.digest}|{tuple(box)}|{key_set(primary).keys}|{secondary}"
+        return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+    def get(self, key: str):
+        """Return the cached sprite, EMPTY for an empty region, or None if it isn't cached."""
+        with self.lock:
+            return self._get(key)
+
+    def put(self, key: str, sprite: Optional[Image]) -> None:
+        """Cache the sprite, None for a region with nothing in it."""
+        with self.lock:
+            self._put(key, sprite)
+
+    def _get(self, key: str):
+        """Look the key up in memory, then on disk."""
+        sprite = self.sprites.get(key)
+        if sprite is not None:
+            self.sprites.move_to_end(key)
+            self.hits += 1
+            return sprite
+
+        path = self._path(key)
+        if path is not None and path.exists():
+            with Image.open(path) as image:
+                image.load()
+                sprite = image
+            self._remember(key, sprite)
+            if path in self.files:
+                self.files.move_to_end(path)
+            self.disk_hits += 1
+            return sprite
+
+        self.misses += 1
+        return None
+
+    def _put(self, key: str, sprite: Optional[Image]) -> None:
+        """Keep the sprite in memory and on disk."""
+        if sprite is None:
+            self._remember(key, EMPTY)
+            return
+        self._remember(key, sprite)
+        path = self._path(key)
+        if path is not None and not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            #write then rename, so a half written file is never read
+            temporary = path.with_suffix(".tmp")
+            sprite.save(temporary, format="PNG", compress_level=1)
+            temporary.replace(path)
+            self.files[path] = path.stat().st_size
+            self.disk_bytes += self.files[path]
+            self._prune()
+
+    def keep(self, keys: Set[str]) -> int:
+        """Forget every sprite whose key is not in keys, in memory and on disk, returns how many files were deleted."""
+        with self.lock:
+            for key in [key for key in self.sprites if key not in keys]:
+                sprite = self.sprites.pop(key)
+                self.bytes -= image_bytes(sprite) if sprite is not EMPTY else 0
+            unused = [path for path in self.files if path.stem not in keys]
+            for path in unused:
+                self.disk_bytes -= self.files.pop(path)
+                _delete(path)
+            return len(unused)
+
+    def stats(self) -> dict:
+        """Return the hit and miss counters."""
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            "sprites": len(self.sprites),
+            "bytes": self.bytes,
+            "disk_bytes": self.disk_bytes}
+
+    def _path(self, key: str) -> Optional[Path]:
+        """Return where the sprite is kept on disk, None without a directory."""
+        if self.directory is None:
+            return None
+        return self.directory / key[:2] / f"{key}.png"
+
+    def _prune(self) -> None:
+        """Delete the least recently used files until the directory fits in max_disk_bytes."""
+        while self.disk_bytes > self.max_disk_bytes and len(self.files) > 1:
+            path, size = self.files.popitem(last=False)
+            self.disk_bytes -= size
+            _delete(path)
+
+    def _remember(self, key: str, sprite) -> None:
+        """Keep the sprite in memory, dropping the least recently used ones over the budget."""
+        if key in self.sprites:
+            return
+        self.sprites[key] = sprite
+        self.bytes += image_bytes(sprite) if sprite is not EMPTY else 0
+        while self.bytes > self.max_bytes and len(self.sprites) > 1:
+            _, old = self.sprites.popitem(last=False)
+            self.bytes -= image_bytes(old) if old is not EMPTY else 0
@@ -0,0 +1,76 @@
+#std lib
+from typing import List, Optional, Tuple
+
+#3rd party
+import numpy
+from PIL import Image
+
+#custom
+from constants import Box, Color, EMPTY_BOX
+from masks import bounding_box, primary_mask
+
+
+def pack(image: Image) -> numpy.ndarray:
+    """Return the image's colors as one 0xBBGGRR integer per pixel."""
+    if image.mode != "RGBA":
+        image = image.convert("RGBA")
+    pixels = numpy.asarray(image).view(numpy.uint32)[..., 0]
+    return pixels & 0xFFFFFF
+
+
+def unpack(value: int) -> Color:
+    """Turn a packed 0xBBGGRR integer back into a Color."""
+    value = int(value)
+    return Color(value & 0xFF, (value >> 8) & 0xFF, (value >> 16) & 0xFF)
+
+
+def ranked(packed: numpy.ndarray) -> List[Tuple[Color, int]]:
+    """Return each packed color and its count, most common first."""
+    colors, counts = numpy.unique(packed, return_counts=True)
+    order = numpy.argsort(-counts, kind="stable")
+    return [(unpack(colors[index]), int(counts[index])) for index in order]
+
+
+def border(image: Image) -> numpy.ndarray:
+    """Return the packed colors along the image's edge."""
+    packed = pack(image)
+    if packed.shape[0] < 3 or packed.shape[1] < 3:
+        return packed.ravel()
+    return numpy.concatenate((packed[0], packed[-1], packed[1:-1, 0], packed[1:-1, -1]))
+
+
+class ColorSuggester():
+    """Suggests key colors for selections of a sheet, counting the colors of each selection as it is made."""
+    def __init__(self, image: Image):
+        self.image = image
+
+    def border(self, box: Box) -> List[Tuple[Color, int]]:
+        """Return the colors along the edge of the box, most common first."""
+        if box == EMPTY_BOX:
+            return []
+        return ranked(border(self.image.crop(box)))
+
+    def suggest(self,
+                box: Box,
+                candidates: Optional[List[Tuple[Color, int]]] = None) -> Tuple[Optional[Color], Optional[Color]]:
+        """Guess the primary and secondary colors for a selection.
+
+            The primary is the most common color along the selection's edge,
+            pass border(box) as candidates if it was already found. The
+            secondary is the most common color along the edge of what is left
+            once the primary is cropped away.
+        """
+        if candidates is None:
+            candidates = self.border(box)
+        if not candidates:
+            return None, None
+        primary = candidates[0][0]
+
+        selection = self.image.crop(box)
+        inner = bounding_box(primary_mask(selection, primary))
+        if inner == EMPTY_BOX:
+            return primary, None
+        for color, _ in ranked(border(selection.crop(inner))):
+            if color != primary:
+                return primary, color
+        return primary, None
@@ -1,6 +1,7 @@
 #std lib
 from collections import namedtuple
 import sys
+from typing import Optional
 
 #3rd party
 from PIL import Image
@@ -8,6 +9,8 @@ from PIL import Image
 Color = namedtuple("Color", ["red", "green", "blue"])
 Point = namedtuple("Point", ["x", "y"])
 Box = namedtuple("Box", ["x1", "y1", "x2", "y2"])
+EMPTY_BOX = Box(0, 0, 0, 0)
+Region = namedtuple("Region", ["box", "primary", "secondary"])
 
 class Pixel:
     def __init__(self, point: Point, color: Color):
@@ -15,3 +18,15 @@ class Pixel:
         self.color = color
 
 # Pixel = namedtuple("Pixel", [("Point", Point), ("Color", Color)])
+
+
+def parse_color(value) -> Optional[Color]:
+    """Turn "#rrggbb", "r g b" or [r, g, b] into a Color."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        value = value.strip()
+        if value.startswith("#"):
+            return Color(*(int(value[i:i + 2], 16) for i in (1, 3, 5)))
+        value = value.replace(",", " ").split()
+    return Color(*(int(channel) for channel in value[:3]))
@@ -1,13 +1,18 @@
 #std lib
-from time import sleep
-from pathlib import Path
+from typing import List, Optional, Tuple
+import weakref
 
 #3rd party
 from PIL import Image
 import pyglet
+from pyglet.gl import GL_NEAREST, GL_TEXTURE_MAG_FILTER, GL_TEXTURE_MIN_FILTER, glBindTexture, glTexParameteri
+from pyglet.image.atlas import TextureBin
 
 #custom
 from constants import Color, Point
+from history import PackedImage, image_bytes, unpack
+from masks import KeySet
+from textures import image_data
 
 
 #setup image directory
@@ -24,6 +29,7 @@ class Details():
 
         #primary color
         self.p_color = (255, 255, 255)
+        self.p_extra = []
         self.p_label = "Pri:"
         self._p_color_box = {"x": 980, "y": 775, "w": 20, "h": 20}
         self.p_pos = None
@@ -45,6 +51,7 @@ class Details():
 
         #secondary color
         self.s_color = (255, 255, 255)
+        self.s_extra = []
         self.s_label = "Sec:"
         self._s_color_box = {"x": 980, "y": 755, "w": 20, "h": 20}
         self.s_pos = None
@@ -64,22 +71,162 @@ class Details():
             color=self.s_color,
             batch=self.batch)
 
+        #how far a pixel may be from a key color and still match
+        self.tolerance = 0
+
+        #kind -> (the colors and tolerance, their KeySet), a KeySet's lookup table is slow to build
+        self.key_sets = {}
+        self.tolerance_label = "Tolerance ([ ]):"
+        self.tolerance_text = pyglet.text.Label(
+            f"{self.tolerance_label} {self.tolerance}",
+            color=self.label_color,
+            x=window.width - box_width + self.label_x_offset,
+            y=455,
+            batch=self.batch)
+
+        #suggested colors for the outline
+        self.suggested_p = None
+        self.suggested_s = None
+        self.suggest_label = "Try (c):"
+        self.suggestion = pyglet.text.Label(
+            self.suggest_label,
+            color=self.label_color,
+            x=window.width - box_width + self.label_x_offset,
+            y=510,
+            batch=self.batch)
+
+        #most common colors along the outline's edge
+        self.swatch_size = 20
+        self.swatches = []
+        for index in range(6):
+            swatch = pyglet.shapes.Rectangle(
+                window.width - box_width + self.label_x_offset + index * (self.swatch_size + 5),
+                480,
+                self.swatch_size,
+                self.swatch_size,
+                color=(255, 255, 255),
+                batch=self.batch)
+            swatch.visible = False
+            self.swatches.append(swatch)
+
+        #how often extractions came from the cache
+        self.cache_label = "Cache:"
+        self.cache = pyglet.text.Label(
+            self.cache_label,
+            color=self.label_color,
+            x=window.width - box_width + self.label_x_offset,
+            y=435,
+            batch=self.batch)
+
+        #what is running in the background
+        self.jobs_label = "Jobs (x cancels):"
+        self.jobs = pyglet.text.Label(
+            self.jobs_label,
+            color=self.label_color,
+            x=window.width - box_width + self.label_x_offset,
+            y=415,
+            width=box_width - 2 * self.label_x_offset,
+            multiline=True,
+            anchor_y="top",
+            batch=self.batch)
+
+        #frames drawn versus redraws merged into them
+        self.frames_label = "Frames:"
+        self.frames = pyglet.text.Label(
+            self.frames_label,
+            color=self.label_color,
+            x=window.width - box_width + self.label_x_offset,
+            y=530,
+            batch=self.batch)
+
     def is_secondary_white(self) -> bool:
         """Checks if secondary color is white."""
         return self.s_color == (255, 255, 255)
 
+    def add_p(self, rgb: Color) -> None:
+        """Add another primary color."""
+        self.p_extra.append((rgb[0], rgb[1], rgb[2]))
+        self.primary.text = f"{self.p_label} {self.p_color} +{len(self.p_extra)}"
+
+    def add_s(self, rgb: Color) -> None:
+        """Add another secondary color."""
+        self.s_extra.append((rgb[0], rgb[1], rgb[2]))
+        self.secondary.text = f"{self.s_label} {self.s_color} +{len(self.s_extra)}"
+
+    def change_tolerance(self, amount: int) -> None:
+        """Change the key color tolerance, between 0 and 255."""
+        self.tolerance = min(max(self.tolerance + amount, 0), 255)
+        self.tolerance_text.text = f"{self.tolerance_label} {self.tolerance}"
+
+    def primary_keys(self) -> KeySet:
+        """Return every primary color with the tolerance, compiled again only after they change."""
+        return self._keys("primary", [self.p_color] + self.p_extra)
+
+    def secondary_keys(self) -> KeySet:
+        """Return every secondary color with the tolerance, compiled again only after they change."""
+        return self._keys("secondary", [self.s_color] + self.s_extra)
+
+    def _keys(self, kind: str, colors: List[Color]) -> KeySet:
+        """Return the KeySet for the colors, reusing the last one while the choices are the same."""
+        choices = (tuple(tuple(color) for color in colors), self.tolerance)
+        cached = self.key_sets.get(kind)
+        if cached is None or cached[0] != choices:
+            self.key_sets[kind] = (choices, KeySet(colors, self.tolerance))
+        return self.key_sets[kind][1]
+
+    def colors(self) -> tuple:
+        """Return the color choices and tolerance."""
+        return (self.p_color, tuple(self.p_extra), self.s_color, tuple(self.s_extra), self.tolerance)
+
+    def restore_colors(self, colors: tuple) -> None:
+        """Set the color choices and tolerance from colors()."""
+        p_color, p_extra, s_color, s_extra, tolerance = colors
+        self.p_color = p_color
+        self.p_extra = list(p_extra)
+        self.s_color = s_color
+        self.s_extra = list(s_extra)
+        self.tolerance = tolerance
+        self.primary.text = f"{self.p_label} {p_color}" + (f" +{len(p_extra)}" if p_extra else "")
+        self.secondary.text = f"{self.s_label} {s_color}" + (f" +{len(s_extra)}" if s_extra else "")
+        self.tolerance_text.text = f"{self.tolerance_label} {self.tolerance}"
+
     def set_p(self, coord: Point, rgb: Color) -> None:
         """Set the primary color."""
         self.p_color = (rgb[0], rgb[1], rgb[2])
+        self.p_extra = []
         self.p_color_box.color = self.p_color
         self.p_pos = coord
 
     def set_s(self, coord: Point, rgb: Color) -> None:
         """Set the secondary color."""
         self.s_color = (rgb[0], rgb[1], rgb[2])
+        self.s_extra = []
         self.s_color_box.color = self.s_color
         self.s_pos = coord
 
+    def set_suggestions(self, primary: Color, secondary: Color, candidates: List[Color]) -> None:
+        """Show the suggested colors and the outline's edge colors."""
+        self.suggested_p = primary
+        self.suggested_s = secondary
+        shown = [tuple(color) if color else "-" for color in (primary, secondary)]
+        self.suggestion.text = f"{self.suggest_label} {shown[0]} {shown[1]}"
+        for index, swatch in enumerate(self.swatches):
+            swatch.visible = index < len(candidates)
+            if swatch.visible:
+                swatch.color = tuple(candidates[index])
+
+    def set_cache_label(self, hits: int, misses: int) -> None:
+        """Change the cache counter's text."""
+        self.cache.text = f"{self.cache_label} {hits} hits, {misses} misses"
+
+    def set_jobs_label(self, jobs: List[str]) -> None:
+        """List the running jobs."""
+        self.jobs.text = "\n".join([self.jobs_label] + jobs[:3])
+
+    def set_frames_label(self, drawn: int, skipped: int) -> None:
+        """Change the frame counter's text."""
+        self.frames.text = f"{self.frames_label} {drawn} drawn, {skipped} skipped"
+
     def set_p_label(self, color) -> None:
         """Change the primary color label's text."""
         self.primary.text = f"{self.p_label} {color}"
@@ -93,9 +240,19 @@ class Details():
         self.s_pos = None
         self.p_color = (255, 255, 255)
         self.s_color = (255, 255, 255)
+        self.p_extra = []
+        self.s_extra = []
+        self.tolerance = 0
+        self.tolerance_text.text = f"{self.tolerance_label} {self.tolerance}"
         self.primary.text = "Pri:"
         self.secondary.text = "Sec:"
-        self.update()
+        self.p_color_box.color = self.p_color
+        self.s_color_box.color = self.s_color
+        self.suggested_p = None
+        self.suggested_s = None
+        self.suggestion.text = self.suggest_label
+        for swatch in self.swatches:
+            swatch.visible = False
 
     def update(self) -> None:
         self.p_color_box.color = self.p_color
@@ -113,8 +270,8 @@ class Controls():
         self.label_x_offset = 10
         self.batch = pyglet.graphics.Batch()
         self.label_color = (0, 0, 0, 255) #Black
-        self.labels_top = 220
-        self.vertical_spacing = 20
+        self.labels_top = 260
+        self.vertical_spacing = 16
 
         self._arrows = pyglet.text.Label(
             "Arrows: UDLR",
@@ -124,16 +281,44 @@ class Controls():
             batch=self.batch)
 
         self._one = pyglet.text.Label(
-            "1:   set primary color",
+            "1:   primary (shift adds)",
             color=self.label_color,
             x=window.width - box_width + self.label_x_offset,
             y=0,
             batch=self.batch)
 
         self._two = pyglet.text.Label(
-            "2:   set secondary color",
+            "2:   secondary (shift adds)",
+            color=self.label_color,
+            x=window.width - box_width + self.label_x_offset,
+            batch=self.batch)
+
+        self._grid = pyglet.text.Label(
+            "g:   extract grid of outline",
+            color=self.label_color,
+            x=window.width - box_width + self.label_x_offset,
+            y=0,
+            batch=self.batch)
+
+        self._auto = pyglet.text.Label(
+            "a:   auto extract",
             color=self.label_color,
             x=window.width - box_width + self.label_x_offset,
+            y=0,
+            batch=self.batch)
+
+        self._tolerance = pyglet.text.Label(
+            "[ ]:  tolerance",
+            color=self.label_color,
+            x=window.width - box_width + self.label_x_offset,
+            y=0,
+            batch=self.batch)
+
+        self._suggested = pyglet.text.Label(
+            "c:   use suggested colors",
+            color=self.label_color,
+            x=window.width - box_width + self.label_x_offset,
+            y=0,
             batch=self.batch)
 
         self._extract = pyglet.text.Label(
@@ -185,6 +370,20 @@ class Controls():
             y=0,
             batch=self.batch)
 
+        self._undo = pyglet.text.Label(
+            "z y:  undo, redo",
+            color=self.label_color,
+            x=window.width - box_width + self.label_x_offset,
+            y=0,
+            batch=self.batch)
+
+        self._timings = pyglet.text.Label(
+            "h t:  timings, export",
+            color=self.label_color,
+            x=window.width - box_width + self.label_x_offset,
+            y=0,
+            batch=self.batch)
+
         self._escape = pyglet.text.Label(
             "esc/q:   Quit",
             color=self.label_color,
@@ -196,13 +395,19 @@ class Controls():
             self._arrows,
             self._one,
             self._two,
+            self._tolerance,
+            self._suggested,
+            self._auto,
+            self._grid,
             self._extract,
             self._save,
             self._view,
             self._scaledown,
             self._scaleup,
             self._reset,
+            self._undo,
             self._save_to_sheet,
+            self._timings,
             self._escape]
 
         for index, label in enumerate(self._label_list):
@@ -212,7 +417,16 @@ class Controls():
         self.batch.draw()
 
 class Preview():
-    def __init__(self, window, box_width):
+    """The slices waiting to be extracted and a scrollable gallery of the extracted sprites.
+
+        The gallery is a fixed grid of sprites in one batch, pointed at
+        thumbnails in a shared texture bin. A thumbnail is uploaded the first
+        time its sprite scrolls into view. The bin can't free single
+        thumbnails, so it is built again once most of its thumbnails belong to
+        sprites that are gone. The oldest slices past slice_budget bytes are
+        handed out to be PNG compressed.
+    """
+    def __init__(self, window, box_width, slice_budget: int = 32 * 1024 * 1024):
         self.window = window
         self.box_width = box_width
         self.batch = pyglet.graphics.Batch()
@@ -228,69 +442,212 @@ class Preview():
             batch=self.batch)
         self.images = []
         self.preview = []
-        self.sprites = []
+        self.slice_budget = slice_budget
+
+        #gallery
+        self.cell = 50
+        self.columns = self.box_width // self.cell
+        self.rows = self.box_height // self.cell
+        self.top_row = 0
+        self.gallery = pyglet.graphics.Batch()
+        self.bin = TextureBin(1024, 1024)
+        self.slots = []
+        self.thumbnails = {}
+        self.dead_thumbnails = 0
+        self.changed = True
 
     def add(self, image: Image) -> None:
         """Add image to list."""
         self.images.append(image)
 
     def add_final_subsprite(self, image:Image) -> None:
-        """Add image to preview list."""
+        """Add image to preview list, scrolling to it if the last row was in view."""
+        at_end = self.top_row >= self._last_row()
         self.preview.append(image)
-        self.sprites.append(self._new_sprite(image))
+        if at_end:
+            self.top_row = self._last_row()
+        self.changed = True
 
     def get(self, index: int) -> Image:
         """Return image from list at index."""
-        return self.images[index]
+        return unpack(self.images[index])
 
-    def get_image(self) -> Image:
-        """Returns recently sliced image."""
+    def get_image(self) -> Optional[Image]:
+        """Returns recently sliced image, maybe packed, or None if there are none."""
+        if not self.images:
+            return None
         return self.images.pop()
 
-    def _new_sprite(self, image) -> pyglet.sprite.Sprite:
-        #save the image in temp dir
-#         temp = "./temp/image.png"
-        temp = "./tempimage.png"
-        image.save(temp)
-
-        #wait for the OS to save the image?
-        while not Path(temp).exists():
-            sleep(0.25)
-        #reload the image in pyglet's format
-        img = pyglet.image.load(temp)
-        sprite = pyglet.sprite.Sprite(
-            img,
-            x=self.window.width - self.box_width,
-            y=self.box_y)
-        sprite.scale = 5
-        return sprite
+    def restore(self, images: tuple, preview: tuple) -> None:
+        """Replace the slices and extracted sprites, reusing the thumbnails already uploaded."""
+        self.images = list(images)
+        self.preview = list(preview)
+        live = {key: entry for key, entry in self.thumbnails.items() if entry[0]() is not None}
+        self.dead_thumbnails += len(self.thumbnails) - len(live)
+        self.thumbnails = live
+        if self.dead_thumbnails > len(live):
+            #the gone thumbnails' space can't be reused, start over and upload the live ones as they are shown
+            self._new_bin()
+        self.top_row = min(self.top_row, self._last_row())
+        self.changed = True
+
+    def scroll(self, rows: int) -> None:
+        """Scroll the gallery down by rows, up if negative."""
+        self.top_row = min(max(self.top_row + rows, 0), self._last_row())
+        self.changed = True
 
     def show_all_final_subsprites(self) -> None:
         for sprite in self.preview:
             sprite.show()
 
     def reset(self) -> None:
-        self.image = []
+        self.images = []
         self.preview = []
-        self.sprites = []
+        for slot in self.slots:
+            slot.delete()
+        self.slots = []
+        self._new_bin()
+        self.top_row = 0
+        self.changed = True
+
+    def _last_row(self) -> int:
+        """Return the top row that shows the last sprite."""
+        rows = -(-len(self.preview) // self.columns)
+        return max(rows - self.rows, 0)
+
+    def _layout(self) -> None:
+        """Point the gallery's sprites at the thumbnails in view."""
+        first = self.top_row * self.columns
+        shown = self.preview[first:first + self.rows * self.columns]
+        left = self.window.width - self.box_width
+        top = self.box_y + self.box_height
+        for index, image in enumerate(shown):
+            region = self._thumbnail(image)
+            if index < len(self.slots):
+                slot = self.slots[index]
+                slot.image = region
+            else:
+                slot = pyglet.sprite.Sprite(region, batch=self.gallery)
+                self.slots.append(slot)
+            #whole steps only, so the pixels stay square
+            slot.scale = max(self.cell // max(region.width, region.height), 1)
+            row, column = divmod(index, self.columns)
+            slot.update(
+                x=left + column * self.cell + (self.cell - region.width * slot.scale) // 2,
+                y=top - (row + 1) * self.cell + (self.cell - region.height * slot.scale) // 2)
+            slot.visible = True
+        for slot in self.slots[len(shown):]:
+            slot.visible = False
+
+    def packed(self, pairs: List[Tuple[Image, PackedImage]]) -> None:
+        """Put each packed slice in place of the raw slice it was packed from."""
+        swap = {id(image): packed for image, packed in pairs}
+        self.images = [swap.get(id(image), image) for image in self.images]
+
+    def to_pack(self) -> List[Image]:
+        """Return the oldest raw slices to compress so the raw ones fit in slice_budget."""
+        raw = [image for image in self.images if not isinstance(image, PackedImage)]
+        total = sum(image_bytes(image) for image in raw)
+        images = []
+        #the newest slice is the one v extracts, keep it as it is
+        for image in raw[:-1]:
+            if total <= self.slice_budget:
+                break
+            total -= image_bytes(image)
+            images.append(image)
+        return images
+
+    def _new_bin(self) -> None:
+        """Drop every thumbnail and start an empty texture bin."""
+        self.thumbnails = {}
+        self.dead_thumbnails = 0
+        self.bin = TextureBin(1024, 1024)
+
+    def _thumbnail(self, image: Image) -> pyglet.image.TextureRegion:
+        """Return the image's thumbnail in the texture bin, uploading it the first time."""
+        entry = self.thumbnails.get(id(image))
+        if entry is not None and entry[0]() is image:
+            return entry[1]
+        thumbnail = image
+        if image.width > self.cell or image.height > self.cell:
+            thumbnail = image.copy()
+            thumbnail.thumbnail((self.cell, self.cell), Image.NEAREST)
+        region = self.bin.add(image_data(thumbnail))
+
+        #keep the pixels sharp when scaled up
+        texture = region.owner
+        glBindTexture(texture.target, texture.id)
+        glTexParameteri(texture.target, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+        glTexParameteri(texture.target, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+
+        self.thumbnails[id(image)] = (weakref.ref(image), region)
+        return region
 
     def update(self) -> None:
         self.batch.draw()
-        
-        #draw the most recent sprite
-        if self.sprites:
-            self.sprites[-1].draw()
+        if self.changed:
+            self._layout()
+            self.changed = False
+        self.gallery.draw()
 
-class ControlPanel():
+class Hud():
+    """Timings drawn over the top-left corner of the workspace."""
     def __init__(self, window):
+        self.batch = pyglet.graphics.Batch()
+        self.visible = False
+        self.width = 360
+        self.background = pyglet.shapes.Rectangle(
+            0,
+            window.height,
+            self.width,
+            0,
+            color=(0, 0, 0),
+            batch=self.batch)
+        self.background.opacity = 180
+        self.text = pyglet.text.Label(
+            "",
+            color=(255, 255, 255, 255),
+            font_name="Courier New",
+            font_size=10,
+            x=8,
+            y=window.height - 8,
+            width=self.width - 16,
+            multiline=True,
+            anchor_y="top",
+            batch=self.batch)
+        self.window = window
+
+    def show(self, rows: Optional[List[dict]]) -> None:
+        """Show the timing rows, or hide the HUD if rows is None."""
+        self.visible = rows is not None
+        if not self.visible:
+            return
+        lines = [f"{'action':18}{'n':>6}{'p50':>8}{'p90':>8}{'p99':>8}  ms"]
+        for row in rows[:12]:
+            lines.append(
+                f"{row['name'][:18]:18}{row['count']:>6}"
+                f"{row['p50'] * 1000:>8.1f}{row['p90'] * 1000:>8.1f}{row['p99'] * 1000:>8.1f}")
+        self.text.text = "\n".join(lines)
+        height = self.text.content_height + 16
+        self.background.y = self.window.height - height
+        self.background.height = height
+
+    def update(self) -> None:
+        if self.visible:
+            self.batch.draw()
+
+
+class ControlPanel():
+    def __init__(self, window, slice_budget: int = 32 * 1024 * 1024):
         self.window = window
         self.box_height = window.height
         self.box_width = 200
 
         #Components
         self.controls = Controls(self.window, self.box_width)
-        self.preview = Preview(self.window, self.box_width)
+        self.preview = Preview(self.window, self.box_width, slice_budget)
         self.details = Details(self.window, self.box_width)
+        self.hud = Hud(self.window)
 
         #Background
         self.box_color = (255, 255, 255) #White
@@ -311,14 +668,71 @@ class ControlPanel():
         """Add extracted sprite to final collection."""
         self.preview.add_final_subsprite(image)
 
+    def cache_counts(self, hits: int, misses: int) -> None:
+        """Show how many extractions came from the cache."""
+        self.details.set_cache_label(hits, misses)
+
+    def show_jobs(self, jobs: List[str]) -> None:
+        """Show the background jobs and their progress."""
+        self.details.set_jobs_label(jobs)
+
+    def show_timings(self, rows: Optional[List[dict]]) -> None:
+        """Show the timings in the HUD, None hides it."""
+        self.hud.show(rows)
+
+    def frame_counts(self, drawn: int, skipped: int) -> None:
+        """Show how many frames were drawn and skipped."""
+        self.details.set_frames_label(drawn, skipped)
+
+    def add_primary_color(self, color) -> None:
+        """Add another primary color."""
+        self.details.add_p(color)
+
+    def add_secondary_color(self, color) -> None:
+        """Add another secondary color."""
+        self.details.add_s(color)
+
+    def change_tolerance(self, amount: int) -> None:
+        """Change the key color tolerance."""
+        self.details.change_tolerance(amount)
+
+    def colors(self) -> tuple:
+        """Return the color choices and tolerance."""
+        return self.details.colors()
+
+    def images(self) -> tuple:
+        """Return the slices and the extracted sprites."""
+        return tuple(self.preview.images), tuple(self.preview.preview)
+
+    def packed(self, pairs: List[Tuple[Image, PackedImage]]) -> None:
+        """Put the packed slices in place of the raw ones."""
+        self.preview.packed(pairs)
+
+    def slices_to_pack(self) -> List[Image]:
+        """Return the raw slices past the slice budget."""
+        return self.preview.to_pack()
+
+    def restore(self, colors: tuple, images: tuple, preview: tuple) -> None:
+        """Set the colors, slices and extracted sprites back to earlier values."""
+        self.details.restore_colors(colors)
+        self.preview.restore(images, preview)
+
     def get_primary_color(self) -> Color:
         """Return the primary color choice."""
         return self.details.p_color
 
+    def get_primary_keys(self) -> KeySet:
+        """Return every primary color with the tolerance."""
+        return self.details.primary_keys()
+
     def get_secondary_color(self) -> Color:
         """Return the secondary color choice."""
         return self.details.s_color
 
+    def get_secondary_keys(self) -> KeySet:
+        """Return every secondary color with the tolerance."""
+        return self.details.secondary_keys()
+
     def is_secondary_white(self) -> bool:
         """Returns True is secondary color is white."""
         return self.details.is_secondary_white()
@@ -337,10 +751,29 @@ class ControlPanel():
         self.details.set_s_label(color)
         self.details.set_s(coord, color)
     
+    def scroll_preview(self, x: int, y: int, rows: int) -> bool:
+        """Scroll the gallery if the point is over it, returns True if it was."""
+        preview = self.preview
+        if x < self.window.width - self.box_width or not preview.box_y <= y < preview.box_y + preview.box_height:
+            return False
+        preview.scroll(rows)
+        return True
+
     def sliced_image(self) -> Image:
         """Returns the recently sliced image."""
         return self.preview.get_image()
 
+    def suggest_colors(self, primary: Color, secondary: Color, candidates: List[Color]) -> None:
+        """Show the suggested primary and secondary colors."""
+        self.details.set_suggestions(primary, secondary, candidates)
+
+    def use_suggested_colors(self) -> None:
+        """Set the primary and secondary colors to the suggested ones."""
+        if self.details.suggested_p is not None:
+            self.primary_color(None, tuple(self.details.suggested_p))
+        if self.details.suggested_s is not None:
+            self.secondary_color(None, tuple(self.details.suggested_s))
+
     def show_all_final_subsprites(self) -> None:
         self.preview.show_all_final_subsprites()
 
@@ -349,6 +782,7 @@ class ControlPanel():
         self.controls.update()
         self.details.update()
         self.preview.update()
+        self.hud.update()
 
     def reset(self) -> None:
         self.details.reset()
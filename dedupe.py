@@ -0,0 +1,86 @@
+"""Find sprites that are the same, so each is stored once in the output sheet.
+
+    Exact duplicates have the same size and the same RGBA bytes, and are
+    found by hashing. Near duplicates have the same size and a difference
+    hash (a 64-bit fingerprint of where the image gets lighter or darker)
+    that differs in at most a few bits. The fingerprints are bucketed by
+    each 16-bit quarter, and two fingerprints within 3 bits of each other
+    share at least one quarter, so only sprites in the same bucket are
+    compared.
+"""
+
+#std lib
+import hashlib
+from typing import Dict, List, Optional
+
+#3rd party
+import numpy
+from PIL import Image
+
+
+def rgba_bytes(image: Image) -> bytes:
+    """Return the image's pixels as RGBA bytes."""
+    if image.mode != "RGBA":
+        image = image.convert("RGBA")
+    return image.tobytes()
+
+
+def difference_hash(image: Image) -> int:
+    """Return a 64-bit fingerprint, one bit per neighbouring pair on a 9x8 thumbnail."""
+    if image.mode != "RGBA":
+        image = image.convert("RGBA")
+    #clear pixels count as black, whatever color they hold
+    background = Image.new("RGBA", image.size, (0, 0, 0, 255))
+    gray = Image.alpha_composite(background, image).convert("L").resize((9, 8), Image.BILINEAR)
+    pixels = numpy.asarray(gray, dtype=numpy.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+    return int.from_bytes(numpy.packbits(bits).tobytes(), "big")
+
+
+def find_duplicates(images: List[Image], near: Optional[int] = None) -> List[int]:
+    """Return, for every image, the index of the first image it duplicates, or its own index.
+
+        near: also treat images of the same size whose difference hashes
+        differ in at most this many bits (0 to 3) as duplicates.
+    """
+    canonical = list(range(len(images)))
+    seen: Dict[tuple, int] = {}
+    for index, image in enumerate(images):
+        digest = hashlib.blake2b(rgba_bytes(image), digest_size=16).digest()
+        key = (image.size, digest)
+        if key in seen:
+            canonical[index] = seen[key]
+        else:
+            seen[key] = index
+
+    if near is None:
+        return canonical
+    if not 0 <= near <= 3:
+        raise ValueError("near must be between 0 and 3 bits")
+
+    #only the distinct images need a fingerprint
+    unique = [index for index in range(len(images)) if canonical[index] == index]
+    hashes = {index: difference_hash(images[index]) for index in unique}
+    buckets: Dict[tuple, List[int]] = {}
+    for index in unique:
+        match = None
+        for quarter in range(4):
+            bucket = (images[index].size, quarter, (hashes[index] >> (16 * quarter)) & 0xFFFF)
+            for other in buckets.get(bucket, ()):
+                if bin(hashes[index] ^ hashes[other]).count("1") <= near:
+                    match = other
+                    break
+            if match is not None:
+                break
+        if match is not None:
+            canonical[index] = match
+            continue
+        for quarter in range(4):
+            bucket = (images[index].size, quarter, (hashes[index] >> (16 * quarter)) & 0xFFFF)
+            buckets.setdefault(bucket, []).append(index)
+
+    #exact copies of a sprite that was merged point at what it was merged into,
+    #every index points lower, so one pass in order settles them all
+    for index in range(len(images)):
+        canonical[index] = canonical[canonical[index]]
+    return canonical
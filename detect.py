@@ -0,0 +1,159 @@
+"""Find the sprites on a sheet without outlining them by hand.
+
+    The sheet is split into horizontal runs of foreground (not the primary
+    color) pixels. Runs that touch, including diagonally, are joined into one
+    sprite. Everything is done with array operations, so the cost is one pass
+    over the sheet plus a little work per run.
+
+    Usage:
+        python3 detect.py <spritesheet.png> <manifest.json> [--primary "#rrggbb"] [--secondary "#rrggbb"]
+"""
+
+#std lib
+import argparse
+import json
+from pathlib import Path
+import sys
+from time import perf_counter
+from typing import List, Tuple, Union
+
+#3rd party
+import numpy
+from PIL import Image
+
+#custom
+from constants import Box, Color, parse_color
+from masks import KeySet, primary_mask
+
+
+def detect_sprites(sheet: Image, background: Union[Color, KeySet], gap: int = 0, min_area: int = 1) -> List[Box]:
+    """Return one box per sprite on the sheet, in reading order.
+
+        gap: fragments at most this many pixels apart are merged into one sprite.
+        min_area: boxes with fewer pixels than this are dropped.
+    """
+    mask = primary_mask(sheet, background)
+    rows, starts, ends = _runs(mask)
+    if not len(rows):
+        return []
+
+    labels = _label(rows, starts, ends, gap)
+
+    #grow a box for each label
+    count = int(labels.max()) + 1
+    left = numpy.full(count, mask.shape[1])
+    top = numpy.full(count, mask.shape[0])
+    right = numpy.zeros(count, dtype=numpy.int64)
+    bottom = numpy.zeros(count, dtype=numpy.int64)
+    numpy.minimum.at(left, labels, starts)
+    numpy.minimum.at(top, labels, rows)
+    numpy.maximum.at(right, labels, ends)
+    numpy.maximum.at(bottom, labels, rows + 1)
+
+    used = numpy.unique(labels)
+    left, top, right, bottom = left[used], top[used], right[used], bottom[used]
+    keep = (right - left) * (bottom - top) >= min_area
+    order = numpy.lexsort((left[keep], top[keep]))
+    boxes = numpy.stack((left[keep], top[keep], right[keep], bottom[keep]), axis=1)[order]
+    return [Box(*(int(edge) for edge in box)) for box in boxes]
+
+
+def _runs(mask: numpy.ndarray) -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    """Return the row, start column and end column (excluded) of each run of True cells."""
+    height, width = mask.shape
+    padded = numpy.zeros((height, width + 2), dtype=numpy.int8)
+    padded[:, 1:-1] = mask
+    edges = numpy.diff(padded, axis=1)
+    rows, columns = numpy.nonzero(edges)
+    rising = edges[rows, columns] == 1
+    return rows[rising], columns[rising], columns[~rising]
+
+
+def _label(rows: numpy.ndarray, starts: numpy.ndarray, ends: numpy.ndarray, gap: int) -> numpy.ndarray:
+    """Give runs that touch, or are within gap pixels of each other, the same label."""
+    count = len(rows)
+    pairs = [_row_neighbours(rows, starts, ends, gap)]
+    for offset in range(1, gap + 2):
+        pairs.append(_column_neighbours(rows, starts, ends, offset, gap))
+    a = numpy.concatenate([pair[0] for pair in pairs])
+    b = numpy.concatenate([pair[1] for pair in pairs])
+
+    #hook the larger root onto the smaller one across every link, then
+    #flatten the trees, until both ends of every link share a root
+    labels = numpy.arange(count)
+    while len(a):
+        root_a = labels[a]
+        root_b = labels[b]
+        apart = root_a != root_b
+        a, b = a[apart], b[apart]
+        root_a, root_b = root_a[apart], root_b[apart]
+        numpy.minimum.at(labels, numpy.maximum(root_a, root_b), numpy.minimum(root_a, root_b))
+        while True:
+            flattened = labels[labels]
+            if numpy.array_equal(flattened, labels):
+                break
+            labels = flattened
+    return labels
+
+
+def _row_neighbours(rows, starts, ends, gap: int) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """Link runs on the same row that are at most gap pixels apart."""
+    if gap <= 0:
+        empty = numpy.zeros(0, dtype=numpy.int64)
+        return empty, empty
+    same_row = rows[1:] == rows[:-1]
+    close = starts[1:] - ends[:-1] <= gap
+    first = numpy.nonzero(same_row & close)[0]
+    return first, first + 1
+
+
+def _column_neighbours(rows, starts, ends, offset: int, gap: int) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """Link each run to the runs offset rows below it that it touches, allowing for gap."""
+    #runs are sorted by row then start, so a single key orders them all
+    width = int(ends.max()) + gap + 2
+    start_keys = rows * width + starts
+    end_keys = rows * width + ends
+
+    #runs below with end + gap >= start and start <= end + gap
+    below = (rows + offset) * width
+    first = numpy.searchsorted(end_keys, below + starts - gap, side="left")
+    last = numpy.searchsorted(start_keys, below + ends + gap, side="right")
+    lengths = numpy.maximum(last - first, 0)
+    a = numpy.repeat(numpy.arange(len(rows)), lengths)
+    b = numpy.arange(lengths.sum()) - numpy.repeat(numpy.cumsum(lengths) - lengths, lengths)
+    b += numpy.repeat(first, lengths)
+    return a, b
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="Write a batch.py manifest with one box per sprite on the sheet.")
+    parser.add_argument("sheet", type=Path, help="sprite sheet to search")
+    parser.add_argument("manifest", type=Path, help="where to write the JSON manifest")
+    parser.add_argument("--primary", help="background color, defaults to the top-left pixel")
+    parser.add_argument("--secondary", help="color to key out of each sprite")
+    parser.add_argument("--tolerance", type=int, default=0, help="per-channel distance that still counts as a key color")
+    parser.add_argument("--gap", type=int, default=0, help="merge fragments at most this many pixels apart")
+    parser.add_argument("--min-area", type=int, default=1, help="drop boxes with fewer pixels than this")
+    args = parser.parse_args(argv)
+
+    sheet = Image.open(args.sheet)
+    primary = parse_color(args.primary) or Color(*sheet.convert("RGB").getpixel((0, 0)))
+    secondary = parse_color(args.secondary)
+
+    start = perf_counter()
+    boxes = detect_sprites(sheet, KeySet([primary], args.tolerance), args.gap, args.min_area)
+    elapsed = perf_counter() - start
+    print(f"{args.sheet}: found {len(boxes)} sprites in {elapsed:.3f}s")
+
+    manifest = {
+        "primary": list(primary),
+        "secondary": list(secondary) if secondary else None,
+        "tolerance": args.tolerance,
+        "regions": [list(box) for box in boxes]}
+    with open(args.manifest, "w") as output:
+        json.dump(manifest, output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
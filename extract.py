@@ -6,14 +6,36 @@
 
     Controls:
         arrows: up down left right
-        1: set the primary reference color.
-        2: set the secondary reference color.
+        1: set the primary reference color, shift+1 adds another one.
+        2: set the secondary reference color, shift+2 adds another one.
+        [ ]: lower or raise the key color tolerance.
+        c: use the suggested primary and secondary colors.
+        a: find every sprite on the sheet and put them in final sprite list.
+        g: outline one cell of a grid, then g extracts every cell of it.
+        x: cancel what is running in the background.
         e: preview single, cleaned slice.
         s: save single, uncleaned slice.
         v: extract the secondary color and put in final sprite list.
         w: save the extracted sprites to their own sheet.
         r: reset everything.
+        z: undo, y: redo.
+        h: show or hide the timings, t: write them to timings/.
+        mouse wheel over the extracted sprites: scroll through them.
         esc/q: quit.
+
+    Usage:
+        ./start <spritesheet.png> [session.jsonl] [--cache <dir>]
+
+    While the outline is dragged, a green box snaps to the tight bounds of
+    what is inside it that is not the primary color, and e, s and v slice
+    that box instead of the whole outline.
+
+    The session is saved as you work, to sessions/<spritesheet>.jsonl unless
+    another file is given, and picked up again the next time the sheet is
+    opened.
+
+    Extracted sprites are cached in memory. --cache <dir> also keeps them in
+    dir between runs, up to 512MB.
 """
 
 #std lib
@@ -22,7 +44,7 @@ import datetime
 from pprint import pprint
 from pathlib import Path
 import sys
-from typing import Any, List, Tuple
+from typing import Any, Callable, List, Optional, Tuple
 
 #3rd party
 from PIL import Image
@@ -30,8 +52,17 @@ import pyglet
 from pyglet.window import key
 
 #custom
-from constants import Color, Point, Pixel
+from atlas import write_atlas
+from constants import Box, Color, Point, Pixel, Region
 from control_panel import ControlPanel
+from history import History, PackedImage, Snapshot, unpack
+from session import Session
+from timing import Timings
+from worker import Job, Worker
+from writer import save_png
+from masks import KeySet
+from grid import grid_bands, grid_boxes
+from pipeline import extract_sprite
 from workspace import Workspace
 
 #Make a window
@@ -43,21 +74,118 @@ window.set_mouse_cursor(cursor)
 
 
 class App():
-    def __init__(self, window, img):
+    def __init__(self, window, img, session_path: Path, cache_dir: Optional[Path] = None):
         self.window = window
-        self.control_panel = ControlPanel(self.window)
-        self.workspace = Workspace(img)
+        #raw slices past this many bytes are kept compressed
+        self.control_panel = ControlPanel(self.window, slice_budget=32 * 1024 * 1024)
+        self.workspace = Workspace(img, cache_dir)
         self.mouse_pos = Point(0, 0)
         self.sprite_outline_b = Point(0, 0)
 
+        #auto detection
+        self.detect_gap = 0
+        self.detect_min_area = 4
+
+        #undo and redo, keeps at most this many bytes of old sprites alive
+        self.history = History(max_bytes=256 * 1024 * 1024)
+
+        #extraction and writing run in the background
+        self.worker = Worker(threads=2, notify=pyglet.app.platform_event_loop.notify)
+        self.chunk_size = 256
+
+        #pixels between the cells of a grid, for g
+        self.grid_spacing = 0
+
+        #"fast", "default" or "max", see writer.PRESETS
+        self.png_preset = "default"
+
+        #identical sprites are stored once, set to 1-3 bits to also merge near identical ones
+        self.near_duplicates = None
+        self.polling = False
+
+        #how long key actions and frames take, off until h is pressed
+        self.timings = Timings()
+
+        #rendering, only redraw when something changed
+        self.dirty = True
+        self.frames_drawn = 0
+        self.frames_skipped = 0
+
+        #pick up where the last session on this sheet left off
+        self.session = Session(session_path, img, self.workspace.sheet_digest())
+        resumed = self.session.resume(self.workspace.reference_image(), self.workspace.cache())
+        if resumed is not None:
+            current = self.snapshot()
+            self.restore(Snapshot(
+                resumed.outline or current.outline,
+                resumed.colors or current.colors,
+                resumed.slices,
+                resumed.sprites))
+            print(f"Resumed {len(resumed.sprites)} sprites from {session_path}.")
+
+        #the resumed state, or the empty one, is the first step of the history
+        self.remember()
+
     def add_slice(self, image: Image) -> None:
         """Add rough image slice to the image list."""
+        self.session.add_slice(image, self.selection_box())
         self.control_panel.add_image(image)
+        self.pack_slices()
 
-    def add_final_subsprite(self, image:Image) -> None:
+    def add_final_subsprite(self, image:Image, box: Optional[Box], p_keys: KeySet, s_keys: KeySet) -> None:
         """Add extracted sprite to final collection."""
+        self.session.add_sprite(image, box, p_keys, s_keys)
         self.control_panel.add_final_subsprite(image)
 
+    def auto_extract(self) -> None:
+        """Find every sprite on the sheet and add them to the final collection, in the background."""
+        p_keys, s_keys = self.p_keys(), self.s_keys()
+        gap, min_area = self.detect_gap, self.detect_min_area
+
+        def run(job: Job) -> Tuple[List[Region], List[Image]]:
+            boxes = self.workspace.detect(p_keys, gap, min_area)
+            regions = [Region(box, p_keys, s_keys) for box in boxes]
+            job.total = len(regions)
+            sprites = []
+            for start in range(0, len(regions), self.chunk_size):
+                chunk = regions[start:start + self.chunk_size]
+                sprites += self.workspace.extract(chunk)
+                job.advance(len(chunk))
+            return regions, sprites
+
+        def done(result: Tuple[List[Region], List[Image]]) -> None:
+            for region, sprite in zip(*result):
+                if sprite is not None:
+                    self.add_final_subsprite(sprite, region.box, p_keys, s_keys)
+
+        self.start_job(Job("auto extract"), run, done)
+
+    def grid_extract(self) -> None:
+        """Extract every cell of the grid the outlined cell belongs to, in the background."""
+        p_keys, s_keys = self.p_keys(), self.s_keys()
+        try:
+            grid = self.workspace.grid(self.ref_img_coords(), self.grid_spacing)
+        except ValueError as error:
+            print(error)
+            return
+
+        def run(job: Job) -> List[Image]:
+            job.total = grid.columns * grid.rows
+            sprites = []
+            #a few rows at a time, to show progress and stop soon after a cancel
+            for band, rows in grid_bands(grid, max(self.chunk_size // grid.columns, 1)):
+                sprites += self.workspace.extract_grid(rows, p_keys, s_keys, band)
+                job.advance(rows.columns * rows.rows)
+            return sprites
+
+        def done(sprites: List[Image]) -> None:
+            for box, sprite in zip(grid_boxes(grid), sprites):
+                if sprite is not None:
+                    self.add_final_subsprite(sprite, box, p_keys, s_keys)
+
+        print(f"Extracting a {grid.columns}x{grid.rows} grid of {grid.width}x{grid.height} cells.")
+        self.start_job(Job("grid"), run, done)
+
     def change_mouse_pos(self, x: int, y: int) -> None:
         """Change the current mouse position."""
         self.mouse_pos = (x, y)
@@ -72,14 +200,108 @@ class App():
 
     def clear_slice_dir(self) -> None:
         """Delete the images in the slice dir."""
+        if not Path("slices").exists():
+            return
         for img in Path("slices").iterdir():
             if img.is_file():
                 img.unlink()
 
-    def crop_subsprite(self, img, mask) -> Image:
-        """Return a cropped subsprite image."""
-        box = self.workspace.crop_subsprite(mask)
-        return img.crop(box)
+    def extract(self, image: Image) -> Image:
+        """Return the extracted sprite with a 1px clear border, or None if the slice is empty."""
+        return extract_sprite(image, self.p_keys(), self.s_keys())
+
+    def extract_slice(self, image: Image) -> None:
+        """Extract the slice and add it to the final collection.
+
+            The slice's box is extracted through the cache, so extracting the
+            same box with the same colors again costs nothing.
+        """
+        p_keys, s_keys = self.p_keys(), self.s_keys()
+        box = self.session.box(image)
+
+        def run(job: Job) -> Image:
+            if box is None:
+                sprite = extract_sprite(unpack(image), p_keys, s_keys)
+            else:
+                sprite = self.workspace.extract([Region(box, p_keys, s_keys)])[0]
+            job.advance()
+            return sprite
+
+        def done(final_image: Image) -> None:
+            if final_image is None:
+                print("There is nothing to extract in the outline.")
+            else:
+                self.add_final_subsprite(final_image, box, p_keys, s_keys)
+
+        self.start_job(Job("extract"), run, done)
+
+    def write_sheet(self) -> None:
+        """Pack the extracted sprites into a new sheet, in the background."""
+        #these images already have the 1px border around them
+        all_images = list(self.control_panel.preview.preview)
+        if not all_images:
+            print("There are no images to save.")
+            return
+        date = datetime.datetime.utcnow()
+        path = Path(f"sprite_sheets/{date}.png")
+
+        def done(_) -> None:
+            print(f"Saved {len(all_images)} sprites to {path}")
+            #clean up the temporary slices dir
+            self.clear_slice_dir()
+
+        preset, near = self.png_preset, self.near_duplicates
+        self.start_job(Job("write sheet"), lambda job: write_atlas(all_images, path, preset, near=near, job=job), done)
+
+    def save_slice(self) -> None:
+        """Save the outlined slice, uncleaned, to slices/ in the background."""
+        image = self.slice()
+        path = Path(f"slices/{datetime.datetime.utcnow()}.png")
+        preset = self.png_preset
+        self.start_job(Job("save slice"), lambda job: save_png(image, path, preset, job), lambda _: None)
+
+    def prepare_snap(self) -> None:
+        """Build the table the outline snaps with, in the background, if the primary colors changed."""
+        keys = self.p_keys()
+        if not self.workspace.needs_integral(keys):
+            return
+        #one at a time, a cancelled or failed build is started again on the next press
+        if any(job.name == "snap table" for job in self.worker.jobs):
+            return
+
+        def done(integral) -> None:
+            self.workspace.set_integral(keys, integral)
+            self.snap_outline()
+
+        self.start_job(Job("snap table"), lambda job: self.workspace.integral(keys), done)
+
+    def snap_outline(self) -> None:
+        """Show the tight box around what is inside the outline."""
+        with self.timings.measure("snap"):
+            self.workspace.snap_outline(self.p_keys())
+
+    def start_job(self, job: Job, run: Callable[[Job], Any], done: Callable[[Any], None]) -> None:
+        """Run the job on the worker and poll for it every frame until it is done."""
+        self.worker.submit(job, run, done)
+        if not self.polling:
+            self.polling = True
+            pyglet.clock.schedule_interval(self.poll_jobs, 1/60)
+
+    def poll_jobs(self, dt) -> None:
+        """Collect finished jobs and show the progress of the rest."""
+        if self.worker.poll():
+            self.remember()
+        self.control_panel.show_jobs([str(job) for job in self.worker.jobs])
+        if not self.worker.busy():
+            self.polling = False
+            pyglet.clock.unschedule(self.poll_jobs)
+        self.mark_dirty()
+
+    def cancel_jobs(self) -> None:
+        """Cancel the jobs in the background."""
+        if not self.worker.busy():
+            print("There is nothing to cancel.")
+        self.worker.cancel()
 
     def first_preview_image(self) -> Image:
         """Return the first preview image."""
@@ -101,6 +323,34 @@ class App():
         """Return the primary color choice."""
         return self.control_panel.get_primary_color()
 
+    def p_keys(self) -> KeySet:
+        """Return all primary colors with the tolerance."""
+        return self.control_panel.get_primary_keys()
+
+    def pack_slices(self) -> None:
+        """Compress the oldest slices past the slice budget, in the background."""
+        #one at a time, the next slice added packs whatever is still over
+        if any(job.name == "pack slices" for job in self.worker.jobs):
+            return
+        images = self.control_panel.slices_to_pack()
+        if not images:
+            return
+
+        def run(job: Job) -> List[Tuple[Image, PackedImage]]:
+            pairs = []
+            for image in images:
+                pairs.append((image, PackedImage(image)))
+                job.advance()
+            return pairs
+
+        def done(pairs: List[Tuple[Image, PackedImage]]) -> None:
+            self.control_panel.packed(pairs)
+            for old, packed in pairs:
+                self.history.swap(old, packed)
+                self.session.alias(old, packed)
+
+        self.start_job(Job("pack slices", len(images)), run, done)
+
     def pan_down(self) -> None:
         """Pan down on the workspace."""
         self.workspace.pan_down()
@@ -121,31 +371,31 @@ class App():
         """Return outline's A and B coordinates."""
         return self.workspace.ref_img_coords()
 
-    def remove_secondary_color(self, sprite: Image) -> Image:
-        """Set the secondary color's alpha to 0."""
-        color = self.s_color()
-        #KUDOS
-        #https://stackoverflow.com/questions/28754852/how-to-set-alpha-value-of-a-pixel-in-python/28758075
-        pixeldata = list(sprite.getdata())
-        for i, pixel in enumerate(pixeldata):
-            if pixel[:3] == color:
-                pixeldata[i] = (255,255,255,0)
-        sprite.putdata(pixeldata)
-        return sprite
-
     def s_color(self) -> Color:
         """Return the secondary color choice."""
         return self.control_panel.get_secondary_color()
 
+    def s_keys(self) -> KeySet:
+        """Return all secondary colors with the tolerance."""
+        return self.control_panel.get_secondary_keys()
+
     def sheet_scale(self) -> int:
         """Return sprite sheet scale size."""
         return self.workspace.sheet_scale()
 
+    def selection_box(self) -> Box:
+        """Return the box on the sheet the outline snaps to."""
+        return self.workspace.selection_box(self.ref_img_coords(), self.p_keys())
+
     def slice(self) -> Image:
-        """Return a slice of the spritesheet."""
+        """Return a slice of the spritesheet, snapped to what is inside the outline."""
         #TODO, separate the reference outline and the sheet outline
         coords = self.ref_img_coords()
-        return self.workspace.slice(coords)
+        return self.workspace.slice(coords, self.p_keys())
+
+    def scroll_preview(self, x: int, y: int, amount: float) -> bool:
+        """Scroll the gallery of extracted sprites if the mouse is over it."""
+        return self.control_panel.scroll_preview(x, y, -round(amount))
 
     def sliced_image(self) -> Image:
         """Returns the recently sliced image."""
@@ -171,6 +421,20 @@ class App():
         pos = self.mouse_pos
         return Point(int((pos[0] - x) // scale), int((pos[1] - y) // scale))
 
+    def add_primary(self) -> None:
+        """Add the color under the mouse to the primary colors."""
+        _, color = self.get_pixel()
+        self.control_panel.add_primary_color(color)
+
+    def add_secondary(self) -> None:
+        """Add the color under the mouse to the secondary colors."""
+        _, color = self.get_pixel()
+        self.control_panel.add_secondary_color(color)
+
+    def change_tolerance(self, amount: int) -> None:
+        """Change the key color tolerance."""
+        self.control_panel.change_tolerance(amount)
+
     def set_primary(self) -> None:
         """Set the primary color."""
         coord, color = self.get_pixel()
@@ -181,6 +445,15 @@ class App():
         coord, color = self.get_pixel()
         self.control_panel.secondary_color(coord, color)
 
+    def suggest_colors(self) -> None:
+        """Show the likely primary and secondary colors for the outline."""
+        primary, secondary, candidates = self.workspace.suggest_colors(self.ref_img_coords())
+        self.control_panel.suggest_colors(primary, secondary, candidates)
+
+    def use_suggested_colors(self) -> None:
+        """Set the primary and secondary colors to the suggested ones."""
+        self.control_panel.use_suggested_colors()
+
     def zoom_in(self) -> None:
         """Zoom in on the workspace."""
         self.workspace.zoom_in()
@@ -190,14 +463,112 @@ class App():
         self.workspace.zoom_out()
 
     def reset(self) -> None:
+        """Clear the colors, outline and sprites, r can be undone."""
         self.control_panel.reset()
         self.workspace.reset()
-        self.clear_slice_dir()
 
-    def update(self, dt) -> None:
+    def snapshot(self) -> Snapshot:
+        """Return the state that undo and redo move between."""
+        slices, sprites = self.control_panel.images()
+        return Snapshot(self.ref_img_coords(), self.control_panel.colors(), slices, sprites)
+
+    def remember(self) -> None:
+        """Add the current state to the history and the session file if it changed."""
+        snapshot = self.snapshot()
+        self.history.record(snapshot)
+        self.session.save(snapshot)
+
+    def restore(self, snapshot: Snapshot) -> None:
+        """Put the outline, colors, slices and sprites back to the snapshot."""
+        self.workspace.restore_outline(snapshot.outline)
+        self.snap_outline()
+        self.control_panel.restore(snapshot.colors, snapshot.slices, snapshot.sprites)
+
+    def toggle_timings(self) -> None:
+        """Start or stop timing, and show or hide the timings."""
+        self.control_panel.show_timings(None if not self.timings.toggle() else [])
+
+    def export_timings(self) -> None:
+        """Write the timings summary as JSON and the trace as CSV."""
+        if not self.timings.samples:
+            print("There are no timings yet, press h to start timing.")
+            return
+        date = datetime.datetime.utcnow()
+        self.timings.export(Path(f"timings/{date}.json"))
+        self.timings.export(Path(f"timings/{date}.csv"))
+        print(f"Timings written to timings/{date}.json and .csv")
+
+    def undo(self) -> None:
+        """Go back one step."""
+        snapshot = self.history.undo()
+        if snapshot is None:
+            print("There is nothing to undo.")
+        else:
+            self.restore(snapshot)
+
+    def redo(self) -> None:
+        """Go forward one step."""
+        snapshot = self.history.redo()
+        if snapshot is None:
+            print("There is nothing to redo.")
+        else:
+            self.restore(snapshot)
+
+    def draw(self) -> None:
+        """Redraw the whole window."""
+        with self.timings.measure("frame"):
+            pending = self._draw()
+
+        #tiles still to upload, come back next frame
+        if pending:
+            pyglet.clock.schedule_once(self.next_frame, 1/60)
+
+    def _draw(self) -> bool:
+        """Draw everything, returns True if some tiles are still to upload."""
+        self.control_panel.frame_counts(self.frames_drawn + 1, self.frames_skipped)
+        cache = self.workspace.cache()
+        self.control_panel.cache_counts(cache.hits + cache.disk_hits, cache.misses)
+        if self.timings.enabled:
+            self.control_panel.show_timings(self.timings.summary())
         self.window.clear()
-        self.workspace.update()
+        pending = self.workspace.update(self.window.width, self.window.height)
         self.control_panel.update()
+        self.frames_drawn += 1
+        self.dirty = False
+        self.window.invalid = False
+        return pending
+
+    def next_frame(self, dt) -> None:
+        """Redraw on the next frame."""
+        self.mark_dirty()
+
+    def mark_dirty(self) -> None:
+        """Ask for a redraw, merging requests made before the next frame."""
+        if self.dirty:
+            self.frames_skipped += 1
+        self.dirty = True
+        self.window.invalid = True
+
+@window.event
+def on_draw():
+    """Draw the window, only called when something changed."""
+    app.draw()
+
+@window.event
+def on_expose():
+    """Redraw when the window is uncovered."""
+    app.mark_dirty()
+
+@window.event
+def on_resize(width, height):
+    """Redraw when the window changes size."""
+    app.mark_dirty()
+
+@window.event
+def on_mouse_scroll(x, y, scroll_x, scroll_y):
+    """Scroll the extracted sprites."""
+    if app.scroll_preview(x, y, scroll_y):
+        app.mark_dirty()
 
 @window.event
 def on_mouse_motion(x, y, dx, dy):
@@ -209,23 +580,37 @@ def on_mouse_drag(x, y, dx, dy, buttons, modifiers):
     """Draw the outline as the mouse is dragged."""
     app.change_mouse_pos(x, y)
     app.change_outline_end()
-    app.workspace.outline.update()
+    app.snap_outline()
+    app.mark_dirty()
 
 @window.event
 def on_mouse_press(x, y, button, modifiers):
     """Set the starting point."""
     app.change_mouse_pos(x, y)
     app.change_outline_start()
+    app.prepare_snap()
+    app.mark_dirty()
 
 @window.event
 def on_mouse_release(x, y, button, modifiers):
     """When you release the mouse button..."""
     app.change_mouse_pos(x, y)
     app.change_outline_end()
+    app.snap_outline()
+    app.suggest_colors()
+    app.remember()
+    app.mark_dirty()
 
 @window.event
 def on_key_release(symbol, modifiers):
+    """Handle the key, timed when the timings are on."""
+    with app.timings.measure(f"key {key.symbol_string(symbol)}"):
+        handle_key(symbol, modifiers)
+
+def handle_key(symbol, modifiers):
     if symbol == key.ESCAPE or symbol == key.Q:
+        app.worker.shutdown()
+        app.session.close()
         quit()
 
     #transformations
@@ -243,23 +628,50 @@ def on_key_release(symbol, modifiers):
         app.pan_right()
 
     #set colors     
+    elif symbol == key._1 and modifiers & key.MOD_SHIFT:
+        app.add_primary()
+    elif symbol == key._2 and modifiers & key.MOD_SHIFT:
+        app.add_secondary()
     elif symbol == key._1:
         app.set_primary()
     elif symbol == key._2:
         app.set_secondary()
+    elif symbol == key.BRACKETLEFT:
+        app.change_tolerance(-1)
+    elif symbol == key.BRACKETRIGHT:
+        app.change_tolerance(1)
+    elif symbol == key.C:
+        app.use_suggested_colors()
 
     #reset values
     elif symbol == key.R:
         app.reset()
 
+    #timings
+    elif symbol == key.H:
+        app.toggle_timings()
+    elif symbol == key.T:
+        app.export_timings()
+
+    #history
+    elif symbol == key.Z:
+        app.undo()
+    elif symbol == key.Y:
+        app.redo()
+
     #save image
     elif symbol == key.S:   
-        preview_image = app.slice()
-        date = datetime.datetime.utcnow()
-        #if dir doesnt exist...
-        if not Path("slices").exists():
-            Path("slices").mkdir()
-        preview_image.save(f"slices/{date}.png")
+        app.save_slice()
+
+    #extract every sprite on the sheet
+    elif symbol == key.A:
+        if not app.is_secondary_white():
+            app.auto_extract()
+
+    #extract the grid the outline is one cell of
+    elif symbol == key.G:
+        if not app.is_secondary_white():
+            app.grid_extract()
 
     #add to preview collection
     elif symbol == key.E:
@@ -268,78 +680,37 @@ def on_key_release(symbol, modifiers):
 
     elif symbol == key.V:
         image = app.sliced_image()
-        if image:
-
-            #create mask for p_color        
-            mask = []
-            for row in range(image.height):
-                mask.append([])
-                for column in range(image.width):
-                    mask[row].append([])
-                    mask[row][column] = (image.getpixel((column, row)) != app.p_color())
-
-            #crop the subsprite out of the main sheet
-            cropped_subsprite = app.crop_subsprite(image, mask)
-            alpha_subsprite = cropped_subsprite.convert("RGBA")
-
-            #remove secondary color if it's not white
-            if not app.is_secondary_white():
-                extracted_sprite = app.remove_secondary_color(alpha_subsprite)
-
-                #add 1px clear border
-                dimensions = (extracted_sprite.width + 2, extracted_sprite.height + 2)
-                color = (0,0,0,0) #transparent
-                final_image = Image.new("RGBA", dimensions, color)
-                final_image.paste(extracted_sprite, (1, 1))
-#                 final_image.show()
-#                 app.add_final_subsprite(extracted_sprite)
-                app.add_final_subsprite(final_image)
+
+        #remove secondary color if it's not white
+        if image and not app.is_secondary_white():
+            app.extract_slice(image)
 
     elif symbol == key.W:
-        #these images already have the 1px border around them
-        all_images = app.control_panel.preview.preview
-        if not all_images:
-            print("There are no images to save.")
-        else:
-            #check heights
-            maxheight = max([image.height for image in all_images])
-            minheight = min([image.height for image in all_images])
-            if maxheight != minheight:
-                for image in enumerate(all_images):
-                    print(image[0], image[1].height)
-                raise Exception("The heights are not the same.")
-
-            #check widths
-            maxwidth = max([image.width for image in all_images])
-            minwidth = min([image.width for image in all_images])
-            if maxwidth != minwidth:
-                for image in enumerate(all_images):
-                    print(image[0], image[1].width)
-                raise Exception("The widths are not the same.")
-
-            #paste into new blank image
-            height = maxheight
-            width = len(all_images * maxwidth)
-            color = (0,0,0,0) #transparent
-            final_image = Image.new("RGBA", (width, height), color)
-            for image in enumerate(all_images):
-                final_image.paste(image[1], (image[0]*image[1].width, 0))
-            final_image.show()
-            date = datetime.datetime.utcnow()
-            final_image.save(f"sprite_sheets/{date}.png")
-        #clean up the temporary slices dir
-        app.clear_slice_dir()
+        app.write_sheet()
+
+    elif symbol == key.X:
+        app.cancel_jobs()
+
+    app.remember()
+    app.mark_dirty()
 
 if __name__ == "__main__":
-    frame_speed = 1/60
     keyboard = key.KeyStateHandler()
     window.push_handlers(keyboard)
 
+    #--cache <dir> keeps the extracted sprites on disk between runs
+    args = sys.argv[1:]
+    cache_dir = None
+    if "--cache" in args:
+        index = args.index("--cache")
+        cache_dir = Path(args[index + 1]) if index + 1 < len(args) else Path("cache")
+        del args[index:index + 2]
+
     #Make sure there is a file argument
     try:
-        img = sys.argv[1]
-        app = App(window, img)
-        pyglet.clock.schedule_interval(app.update, frame_speed)
+        img = args[0]
+        session_path = Path(args[1]) if len(args) > 1 else Path("sessions") / f"{Path(img).stem}.jsonl"
+        app = App(window, img, session_path, cache_dir)
         pyglet.app.run()
     except IndexError:
         print("You need to specify a spritesheet to work on.")
@@ -0,0 +1,131 @@
+"""Extract every cell of a sheet laid out as a regular grid.
+
+    The sheet's pixels are viewed as a (rows, columns, height, width) array
+    of cells with numpy strides, so masking and finding each cell's tight
+    box is done for the whole grid at once, without copying any cell.
+"""
+
+#std lib
+from collections import namedtuple
+from typing import List, Optional, Tuple, Union
+
+#3rd party
+import numpy
+from numpy.lib.stride_tricks import as_strided
+from PIL import Image
+
+#custom
+from constants import Box, Color
+from keying import remove_color_batch
+from masks import KeySet, key_set
+from pipeline import add_border
+
+#left and top are the margins before the first cell, spacing is the gap between cells
+Grid = namedtuple("Grid", ["columns", "rows", "width", "height", "left", "top", "spacing"])
+
+
+def grid_boxes(grid: Grid) -> List[Box]:
+    """Return the box of every cell, row by row."""
+    boxes = []
+    for row in range(grid.rows):
+        for column in range(grid.columns):
+            x = grid.left + column * (grid.width + grid.spacing)
+            y = grid.top + row * (grid.height + grid.spacing)
+            boxes.append(Box(x, y, x + grid.width, y + grid.height))
+    return boxes
+
+
+def grid_bands(grid: Grid, rows: int) -> List[Tuple[Box, Grid]]:
+    """Split the grid into bands of at most rows rows.
+
+        Returns each band's box on the sheet and the band's grid, placed
+        relative to the box, to run extract_grid() on the box's crop.
+    """
+    right = grid.left + grid.columns * (grid.width + grid.spacing) - grid.spacing
+    bands = []
+    for first in range(0, grid.rows, rows):
+        count = min(rows, grid.rows - first)
+        top = grid.top + first * (grid.height + grid.spacing)
+        bottom = top + count * (grid.height + grid.spacing) - grid.spacing
+        bands.append((Box(0, top, right, bottom), grid._replace(rows=count, top=0)))
+    return bands
+
+
+def grid_from_cell(size: Tuple[int, int], cell: Box, spacing: int = 0) -> Grid:
+    """Return the grid that covers a sheet of the given size with cells like cell."""
+    width, height = cell.x2 - cell.x1, cell.y2 - cell.y1
+    if width <= 0 or height <= 0:
+        raise ValueError("The cell needs a width and a height.")
+    left = cell.x1 % (width + spacing)
+    top = cell.y1 % (height + spacing)
+    columns = (size[0] - left + spacing) // (width + spacing)
+    rows = (size[1] - top + spacing) // (height + spacing)
+    return Grid(columns, rows, width, height, left, top, spacing)
+
+
+def cells(pixels: numpy.ndarray, grid: Grid) -> numpy.ndarray:
+    """Return a (rows, columns, height, width, ...) view of the grid's cells."""
+    if grid.left + grid.columns * (grid.width + grid.spacing) - grid.spacing > pixels.shape[1] \
+            or grid.top + grid.rows * (grid.height + grid.spacing) - grid.spacing > pixels.shape[0]:
+        raise ValueError("The grid is bigger than the sheet.")
+    row_stride, column_stride = pixels.strides[:2]
+    origin = pixels[grid.top:, grid.left:]
+    return as_strided(
+        origin,
+        shape=(grid.rows, grid.columns, grid.height, grid.width) + pixels.shape[2:],
+        strides=((grid.height + grid.spacing) * row_stride,
+                 (grid.width + grid.spacing) * column_stride,
+                 row_stride,
+                 column_stride) + pixels.strides[2:],
+        writeable=False)
+
+
+def cell_boxes(sheet: Image, grid: Grid, primary: Union[Color, KeySet]) -> List[Optional[Box]]:
+    """Return the tight box around the non-primary pixels of every cell, None for empty cells."""
+    keys = key_set(primary)
+    if sheet.mode == "P":
+        background = keys.matches_palette(sheet)[cells(numpy.asarray(sheet), grid)]
+    else:
+        pixels = numpy.asarray(sheet if sheet.mode in ("RGB", "RGBA") else sheet.convert("RGB"))
+        background = keys.matches(cells(pixels, grid))
+    foreground = ~background
+
+    #rows and columns of each cell that hold something
+    rows = foreground.any(axis=3)
+    columns = foreground.any(axis=2)
+    top = rows.argmax(axis=2)
+    bottom = grid.height - rows[..., ::-1].argmax(axis=2)
+    left = columns.argmax(axis=2)
+    right = grid.width - columns[..., ::-1].argmax(axis=2)
+    filled = rows.any(axis=2)
+
+    boxes = []
+    for cell, box in enumerate(grid_boxes(grid)):
+        row, column = divmod(cell, grid.columns)
+        if not filled[row, column]:
+            boxes.append(None)
+            continue
+        boxes.append(Box(
+            box.x1 + int(left[row, column]),
+            box.y1 + int(top[row, column]),
+            box.x1 + int(right[row, column]),
+            box.y1 + int(bottom[row, column])))
+    return boxes
+
+
+def extract_grid(sheet: Image,
+                 grid: Grid,
+                 primary: Union[Color, KeySet],
+                 secondary: Union[Color, KeySet, None]) -> List[Optional[Image]]:
+    """Run the mask, crop, key and border steps on every cell, row by row.
+
+        Empty cells come back as None.
+    """
+    boxes = cell_boxes(sheet, grid, primary)
+    if sheet.mode not in ("P", "RGBA"):
+        sheet = sheet.convert("RGBA")
+    if secondary is not None:
+        #every cell is keyed the same way, so key the whole sheet in one pass
+        sheet = remove_color_batch([sheet], secondary)[0]
+    sprites = iter([add_border(sheet.crop(box)) for box in boxes if box is not None])
+    return [next(sprites) if box is not None else None for box in boxes]
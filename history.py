@@ -0,0 +1,156 @@
+"""Undo and redo for the editing session.
+
+    Each step is a Snapshot of immutable values: the outline's points, the
+    color choices, and tuples of the slices and extracted sprites. Snapshots
+    hold references to the images, never copies, so an image that is in many
+    steps is stored once. The images the history keeps alive are counted
+    against a byte limit and the oldest steps are dropped to stay under it.
+"""
+
+#std lib
+from collections import deque, namedtuple
+import io
+from typing import Dict, Optional, Union
+
+#3rd party
+from PIL import Image
+
+
+Snapshot = namedtuple("Snapshot", ["outline", "colors", "slices", "sprites"])
+
+
+class PackedImage():
+    """An image kept as PNG bytes, for images that are held on to but rarely looked at."""
+    def __init__(self, image: Image):
+        self.size = image.size
+        self.mode = image.mode
+        output = io.BytesIO()
+        image.save(output, format="PNG", compress_level=1)
+        self.data = output.getvalue()
+
+    def unpack(self) -> Image:
+        """Return the image decoded again."""
+        with Image.open(io.BytesIO(self.data)) as image:
+            image.load()
+            return image
+
+
+def unpack(image: Union[Image, PackedImage]) -> Image:
+    """Return the image, decoding it if it is packed."""
+    if isinstance(image, PackedImage):
+        return image.unpack()
+    return image
+
+
+def image_bytes(image: Union[Image, PackedImage]) -> int:
+    """Return the size of the image's pixels in memory."""
+    if isinstance(image, PackedImage):
+        return len(image.data)
+    return image.width * image.height * len(image.getbands())
+
+
+def same(a: Snapshot, b: Snapshot) -> bool:
+    """Return True if the snapshots hold the same values and the same images."""
+    return (a.outline == b.outline
+            and a.colors == b.colors
+            and len(a.slices) == len(b.slices)
+            and len(a.sprites) == len(b.sprites)
+            and all(x is y for x, y in zip(a.slices, b.slices))
+            and all(x is y for x, y in zip(a.sprites, b.sprites)))
+
+
+class History():
+    """Undo and redo stacks around the current snapshot."""
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current = None
+        self.undo_stack = deque()
+        self.redo_stack = []
+
+        #id -> [number of snapshots holding the image, its size]
+        self._images: Dict[int, list] = {}
+        self.bytes = 0
+
+    def __len__(self) -> int:
+        return len(self.undo_stack)
+
+    def record(self, snapshot: Snapshot) -> bool:
+        """Make the snapshot the current step, returns False if nothing changed."""
+        if self.current is not None and same(snapshot, self.current):
+            return False
+        self._retain(snapshot)
+        if self.current is not None:
+            self.undo_stack.append(self.current)
+        for step in self.redo_stack:
+            self._release(step)
+        self.redo_stack = []
+        self.current = snapshot
+        self._evict()
+        return True
+
+    def undo(self) -> Optional[Snapshot]:
+        """Step back, returns the snapshot to restore or None if there is none."""
+        if not self.undo_stack:
+            return None
+        self.redo_stack.append(self.current)
+        self.current = self.undo_stack.pop()
+        return self.current
+
+    def redo(self) -> Optional[Snapshot]:
+        """Step forward again, returns the snapshot to restore or None if there is none."""
+        if not self.redo_stack:
+            return None
+        self.undo_stack.append(self.current)
+        self.current = self.redo_stack.pop()
+        return self.current
+
+    def clear(self) -> None:
+        """Forget every step."""
+        self.current = None
+        self.undo_stack.clear()
+        self.redo_stack = []
+        self._images = {}
+        self.bytes = 0
+
+    def swap(self, old: Image, new: Union[Image, PackedImage]) -> None:
+        """Put new in place of old in every step, so a packed slice frees the raw one."""
+        entry = self._images.pop(id(old), None)
+        if entry is None:
+            return
+
+        def replace(snapshot: Snapshot) -> Snapshot:
+            if not any(image is old for image in snapshot.slices):
+                return snapshot
+            return snapshot._replace(slices=tuple(new if image is old else image for image in snapshot.slices))
+
+        self.current = replace(self.current)
+        self.undo_stack = deque(replace(step) for step in self.undo_stack)
+        self.redo_stack = [replace(step) for step in self.redo_stack]
+        size = image_bytes(new)
+        self._images[id(new)] = [entry[0], size]
+        self.bytes += size - entry[1]
+
+    def _evict(self) -> None:
+        """Drop the oldest steps until the kept images fit in max_bytes."""
+        while self.bytes > self.max_bytes and self.undo_stack:
+            self._release(self.undo_stack.popleft())
+
+    def _retain(self, snapshot: Snapshot) -> None:
+        """Count the snapshot's references to its images."""
+        for image in snapshot.slices + snapshot.sprites:
+            entry = self._images.get(id(image))
+            if entry is None:
+                size = image_bytes(image)
+                self._images[id(image)] = [1, size]
+                self.bytes += size
+            else:
+                entry[0] += 1
+
+    def _release(self, snapshot: Snapshot) -> None:
+        """Remove the snapshot's references, forgetting images no step holds."""
+        for image in snapshot.slices + snapshot.sprites:
+            entry = self._images[id(image)]
+            entry[0] -= 1
+            if not entry[0]:
+                del self._images[id(image)]
+                self.bytes -= entry[1]
@@ -0,0 +1,63 @@
+#std lib
+from typing import List, Union
+
+#3rd party
+import numpy
+from PIL import Image
+
+#custom
+from constants import Color
+from masks import KeySet, key_set
+
+CLEAR = (255, 255, 255, 0)
+
+
+def remove_color(sprite: Image, keys: Union[Color, KeySet]) -> Image:
+    """Return an RGBA copy of the sprite with the key colors' alpha set to 0."""
+    return remove_color_batch([sprite], keys)[0]
+
+
+def remove_color_batch(sprites: List[Image], keys: Union[Color, KeySet]) -> List[Image]:
+    """Set the key colors' alpha to 0 in every sprite using one pass over their joined buffers.
+
+        Palette sprites stay palette sprites, only their transparency entries change.
+    """
+    keys = key_set(keys)
+    keyed = [remove_palette_color(sprite, keys) if sprite.mode == "P" else None for sprite in sprites]
+    others = [sprite for sprite in sprites if sprite.mode != "P"]
+    if not others:
+        return keyed
+
+    arrays = [numpy.asarray(sprite.convert("RGBA")).reshape(-1, 4) for sprite in others]
+    pixels = numpy.concatenate(arrays)
+    pixels[keys.matches(pixels)] = CLEAR
+
+    start = 0
+    chunks = []
+    for sprite in others:
+        end = start + sprite.width * sprite.height
+        chunk = pixels[start:end].reshape(sprite.height, sprite.width, 4)
+        chunks.append(Image.fromarray(chunk))
+        start = end
+    chunks.reverse()
+    return [sprite if sprite is not None else chunks.pop() for sprite in keyed]
+
+
+def remove_palette_color(sprite: Image, keys: Union[Color, KeySet]) -> Image:
+    """Return a copy of the palette sprite with the key colors' palette entries made transparent."""
+    alpha = transparency(sprite)
+    alpha[key_set(keys).matches_palette(sprite)] = 0
+    keyed = sprite.copy()
+    keyed.info["transparency"] = alpha.tobytes()
+    return keyed
+
+
+def transparency(sprite: Image) -> numpy.ndarray:
+    """Return the alpha of each of the palette sprite's 256 entries."""
+    alpha = numpy.full(256, 255, dtype=numpy.uint8)
+    current = sprite.info.get("transparency")
+    if isinstance(current, int):
+        alpha[current] = 0
+    elif current is not None:
+        alpha[:len(current)] = numpy.frombuffer(current, dtype=numpy.uint8)
+    return alpha
@@ -0,0 +1,193 @@
+#std lib
+from typing import Iterable, Tuple, Union
+
+#3rd party
+import numpy
+from PIL import Image
+
+#custom
+from constants import Box, Color, EMPTY_BOX
+
+
+class KeySet():
+    """Any number of key colors, each with its own tolerance.
+
+        A tolerance is either a per-channel distance, a single number or one
+        per channel, or a Euclidean distance when metric is "euclidean". The
+        set is compiled into a lookup table over every RGB value, so testing
+        a pixel costs the same however many colors are in the set.
+    """
+    def __init__(self, colors: Iterable[Color] = (), tolerance=0, metric: str = "channel"):
+        self.keys = []
+        self._table = None
+        for color in colors:
+            self.add(color, tolerance, metric)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, KeySet) and self.keys == other.keys
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __repr__(self) -> str:
+        return f"KeySet({self.keys})"
+
+    def add(self, color: Color, tolerance=0, metric: str = "channel") -> None:
+        """Add a key color."""
+        if metric not in ("channel", "euclidean"):
+            raise ValueError(f"Unknown metric: {metric}")
+        if metric == "channel" and not isinstance(tolerance, (tuple, list)):
+            tolerance = (tolerance,) * 3
+        if isinstance(tolerance, list):
+            tolerance = tuple(tolerance)
+        self.keys.append((tuple(int(channel) for channel in color[:3]), tolerance, metric))
+        self._table = None
+
+    def colors(self) -> Tuple[Color, ...]:
+        """Return the key colors."""
+        return tuple(Color(*color) for color, _, _ in self.keys)
+
+    def _exact(self) -> bool:
+        """Return True if the set is a single color with no tolerance."""
+        return len(self.keys) == 1 and self.keys[0][1] in (0, (0, 0, 0))
+
+    def table(self) -> numpy.ndarray:
+        """Return the compiled 256x256x256 lookup table, True for key colors."""
+        if self._table is None:
+            table = numpy.zeros((256, 256, 256), dtype=bool)
+            for color, tolerance, metric in self.keys:
+                if metric == "channel":
+                    low = [max(channel - spread, 0) for channel, spread in zip(color, tolerance)]
+                    high = [min(channel + spread, 255) + 1 for channel, spread in zip(color, tolerance)]
+                    table[low[0]:high[0], low[1]:high[1], low[2]:high[2]] = True
+                else:
+                    radius = int(tolerance)
+                    low = [max(channel - radius, 0) for channel in color]
+                    high = [min(channel + radius, 255) + 1 for channel in color]
+                    red, green, blue = numpy.ogrid[low[0]:high[0], low[1]:high[1], low[2]:high[2]]
+                    distance = (red - color[0]) ** 2 + (green - color[1]) ** 2 + (blue - color[2]) ** 2
+                    table[low[0]:high[0], low[1]:high[1], low[2]:high[2]] |= distance <= tolerance ** 2
+            self._table = table
+        return self._table
+
+    def matches(self, pixels: numpy.ndarray) -> numpy.ndarray:
+        """Return True for every pixel in a (..., 3 or 4) array that is a key color."""
+        if not self.keys:
+            return numpy.zeros(pixels.shape[:-1], dtype=bool)
+        if self._exact():
+            red, green, blue = self.keys[0][0]
+            return ((pixels[..., 0] == red)
+                    & (pixels[..., 1] == green)
+                    & (pixels[..., 2] == blue))
+        return self.table()[pixels[..., 0], pixels[..., 1], pixels[..., 2]]
+
+    def matches_image(self, image: Image) -> numpy.ndarray:
+        """Return a 2D boolean array, True where the image's pixel is a key color.
+
+            Palette images are tested one palette entry at a time and the
+            result is looked up by each pixel's 8-bit index.
+        """
+        if image.mode == "P":
+            return self.matches_palette(image)[numpy.asarray(image)]
+        return self.matches(_pixels(image))
+
+    def matches_palette(self, image: Image) -> numpy.ndarray:
+        """Return a boolean for each of the 256 palette entries, True for key colors."""
+        palette = numpy.zeros((256, 3), dtype=numpy.uint8)
+        entries = numpy.array(image.getpalette()[:768], dtype=numpy.uint8).reshape(-1, 3)
+        palette[:len(entries)] = entries
+        return self.matches(palette)
+
+
+class IntegralMask():
+    """Summed-area table of a 2D boolean mask.
+
+        table[y, x] counts the True cells above and left of (x, y), so the
+        count inside any box is four lookups whatever its size, and the tight
+        box inside a box takes a binary search per side.
+    """
+    def __init__(self, mask: numpy.ndarray):
+        self.height, self.width = mask.shape
+        dtype = numpy.int32 if mask.size < 2 ** 31 else numpy.int64
+        self.table = numpy.zeros((self.height + 1, self.width + 1), dtype=dtype)
+        numpy.cumsum(mask, axis=0, dtype=dtype, out=self.table[1:, 1:])
+        numpy.cumsum(self.table[1:, 1:], axis=1, out=self.table[1:, 1:])
+
+    def _clip(self, box: Box) -> Box:
+        """Return the box clipped to the mask."""
+        x1 = min(max(box.x1, 0), self.width)
+        y1 = min(max(box.y1, 0), self.height)
+        x2 = min(max(box.x2, x1), self.width)
+        y2 = min(max(box.y2, y1), self.height)
+        return Box(x1, y1, x2, y2)
+
+    def _count(self, x1: int, y1: int, x2: int, y2: int) -> int:
+        """Return the number of True cells in an already clipped box."""
+        table = self.table
+        return int(table[y2, x2] - table[y1, x2] - table[y2, x1] + table[y1, x1])
+
+    def count(self, box: Box) -> int:
+        """Return the number of True cells in the box."""
+        return self._count(*self._clip(box))
+
+    def empty(self, box: Box) -> bool:
+        """Return True if the box holds no True cells."""
+        return self.count(box) == 0
+
+    def tight(self, box: Box) -> Box:
+        """Return the tight box around the True cells inside box, or EMPTY_BOX if there are none."""
+        x1, y1, x2, y2 = self._clip(box)
+        if self._count(x1, y1, x2, y2) == 0:
+            return EMPTY_BOX
+        left = _first(x1, x2 - 1, lambda x: self._count(x1, y1, x + 1, y2) > 0)
+        right = _first(left, x2 - 1, lambda x: self._count(x + 1, y1, x2, y2) == 0) + 1
+        top = _first(y1, y2 - 1, lambda y: self._count(left, y1, right, y + 1) > 0)
+        bottom = _first(top, y2 - 1, lambda y: self._count(left, y + 1, right, y2) == 0) + 1
+        return Box(left, top, right, bottom)
+
+
+def _first(low: int, high: int, test) -> int:
+    """Return the smallest value in [low, high] that passes test, which must pass at high and stay passing."""
+    while low < high:
+        middle = (low + high) // 2
+        if test(middle):
+            high = middle
+        else:
+            low = middle + 1
+    return low
+
+
+def key_set(keys: Union[Color, KeySet, None]) -> KeySet:
+    """Return keys as a KeySet, a single color becomes a set of one."""
+    if isinstance(keys, KeySet):
+        return keys
+    if keys is None:
+        return KeySet()
+    return KeySet([keys])
+
+
+def _pixels(image: Image) -> numpy.ndarray:
+    """Return the image's RGB(A) buffer as a (height, width, bands) array."""
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGB")
+    return numpy.asarray(image)
+
+
+def primary_mask(image: Image, keys: Union[Color, KeySet]) -> numpy.ndarray:
+    """Return a 2D boolean array, True where the pixel is not a primary color."""
+    return ~key_set(keys).matches_image(image)
+
+
+def bounding_box(mask: numpy.ndarray) -> Box:
+    """Return the tight box around the True cells of the mask, or EMPTY_BOX if there are none."""
+    if mask.size == 0:
+        return EMPTY_BOX
+    rows = mask.any(axis=1)
+    top = int(rows.argmax())
+    if not rows[top]:
+        return EMPTY_BOX
+    bottom = len(rows) - int(rows[::-1].argmax())
+    columns = mask[top:bottom].any(axis=0)
+    left = int(columns.argmax())
+    right = len(columns) - int(columns[::-1].argmax())
+    return Box(left, top, right, bottom)
@@ -0,0 +1,125 @@
+"""Sprite extraction steps shared by the GUI and the headless batch tool.
+
+    Nothing in here imports pyglet, so it can run on machines without a display.
+"""
+
+#std lib
+from pathlib import Path
+from typing import List, Optional
+
+#3rd party
+import numpy
+from PIL import Image
+
+#custom
+from cache import EMPTY, SpriteCache
+from constants import Box, Color, EMPTY_BOX, Region
+from keying import remove_color_batch, transparency
+from masks import KeySet, bounding_box, primary_mask
+
+
+def add_border(sprite: Image) -> Image:
+    """Return the sprite with a 1px clear border around it.
+
+        Palette sprites keep their palette if one of its entries is already clear.
+    """
+    dimensions = (sprite.width + 2, sprite.height + 2)
+    if sprite.mode == "P":
+        clear = numpy.flatnonzero(transparency(sprite) == 0)
+        if len(clear):
+            final_image = Image.new("P", dimensions, int(clear[0]))
+            final_image.putpalette(sprite.getpalette())
+            final_image.info["transparency"] = sprite.info["transparency"]
+            final_image.paste(sprite, (1, 1))
+            return final_image
+        sprite = sprite.convert("RGBA")
+    color = (0, 0, 0, 0) #transparent
+    final_image = Image.new("RGBA", dimensions, color)
+    final_image.paste(sprite, (1, 1))
+    return final_image
+
+
+def crop_subsprite(image: Image, primary: Color) -> Optional[Image]:
+    """Crop the image down to the pixels that are not the primary color."""
+    box = bounding_box(primary_mask(image, primary))
+    if box == EMPTY_BOX:
+        return None
+    return image.crop(box)
+
+
+def extract_sprite(image: Image, primary: Color, secondary: Optional[Color]) -> Optional[Image]:
+    """Run the mask, crop, key and border steps on a single slice."""
+    return extract_sprites([image], [primary], [secondary])[0]
+
+
+def extract_sprites(images: List[Image],
+                    primaries: List[Color],
+                    secondaries: List[Optional[Color]]) -> List[Optional[Image]]:
+    """Run the mask, crop, key and border steps on many slices.
+
+        Slices that share a secondary color are keyed together in one pass.
+        Slices with nothing but the primary color in them come back as None.
+        Palette slices stay palette images.
+    """
+    cropped = [crop_subsprite(image, primary) for image, primary in zip(images, primaries)]
+
+    #group the crops by secondary color, KeySets by their keys since they can change
+    groups = {}
+    for index, sprite in enumerate(cropped):
+        if sprite is not None:
+            color = secondaries[index]
+            group = tuple(color.keys) if isinstance(color, KeySet) else color
+            groups.setdefault(group, (color, []))[1].append(index)
+
+    extracted = [None] * len(images)
+    for color, indexes in groups.values():
+        sprites = [_keyable(cropped[index]) for index in indexes]
+        if color is not None:
+            sprites = remove_color_batch(sprites, color)
+        for index, sprite in zip(indexes, sprites):
+            extracted[index] = add_border(sprite)
+    return extracted
+
+
+def extract_regions(sheet: Image,
+                    regions: List[Region],
+                    cache: Optional[SpriteCache] = None) -> List[Optional[Image]]:
+    """Extract every region of the sheet, only the ones not in the cache if one is given."""
+    if cache is None:
+        images = [slice_sheet(sheet, region.box) for region in regions]
+        primaries = [region.primary for region in regions]
+        secondaries = [region.secondary for region in regions]
+        return extract_sprites(images, primaries, secondaries)
+
+    keys = [cache.key(*region) for region in regions]
+    found = [cache.get(key) for key in keys]
+    missing = [index for index, sprite in enumerate(found) if sprite is None]
+    extracted = extract_regions(sheet, [regions[index] for index in missing])
+    for index, sprite in zip(missing, extracted):
+        cache.put(keys[index], sprite)
+        found[index] = sprite
+    return [None if sprite is EMPTY else sprite for sprite in found]
+
+
+def load_sheet(path: Path) -> Image:
+    """Decode the sheet once, as RGBA.
+
+        Palette sheets are kept as palette images, at a byte per pixel.
+    """
+    with Image.open(path) as image:
+        if image.mode == "P":
+            image.load()
+            return image.copy()
+        return image.convert("RGBA")
+
+
+def _keyable(sprite: Image) -> Image:
+    """Return the sprite as RGBA, or as is when it is already RGBA or a palette image."""
+    if sprite.mode in ("P", "RGBA"):
+        return sprite
+    return sprite.convert("RGBA")
+
+
+def slice_sheet(sheet: Image, box: Box) -> Image:
+    """Return the box's slice of the sheet, using PIL's top-left origin."""
+    return sheet.crop(box)
@@ -0,0 +1,266 @@
+"""Save the editing session as it happens and pick it up again later.
+
+    The session file is JSON lines that are only ever appended to, so saving
+    after every change costs one short write. Sprites are saved as the box
+    and key colors they were extracted with, and are extracted again when the
+    session is resumed.
+
+    Records:
+        {"type": "sheet", "path": "sheet.png", "sha256": "..."}
+        {"type": "colors", "colors": [[0, 128, 128], [], [255, 255, 255], [], 0]}
+        {"type": "outline", "coords": [[10, 20], [50, 60]]}
+        {"type": "slice", "id": 0, "box": [8, 8, 40, 40]}
+        {"type": "sprite", "id": 1, "box": [8, 8, 40, 40], "primary": [...], "secondary": [...]}
+        {"type": "slices" or "sprites", "append": [1]} or {..., "ids": [0, 1]}
+
+    A sheet record starts the session over, everything before it is ignored.
+"""
+
+#std lib
+import json
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+import weakref
+
+#3rd party
+from PIL import Image
+
+#custom
+from cache import SpriteCache, file_digest
+from constants import Box, Point, Region
+from history import Snapshot
+from masks import KeySet
+from pipeline import extract_regions, slice_sheet
+
+
+def keys_to_json(keys: Optional[KeySet]) -> Optional[list]:
+    """Return the key set as [[color, tolerance, metric], ...]."""
+    if keys is None:
+        return None
+    return [[list(color), tolerance, metric] for color, tolerance, metric in keys.keys]
+
+
+def keys_from_json(value: Optional[list]) -> Optional[KeySet]:
+    """Turn keys_to_json() back into a KeySet."""
+    if value is None:
+        return None
+    keys = KeySet()
+    for color, tolerance, metric in value:
+        keys.add(color, tolerance, metric)
+    return keys
+
+
+class Session():
+    """Appends the changes made to the session to a JSON lines file."""
+    def __init__(self, path: Path, sheet: Path, digest: Optional[str] = None):
+        self.path = Path(path)
+        self.sheet = Path(sheet)
+        self.digest = digest
+        self.next_id = 0
+        self.records = 0
+        self.file = None
+
+        #what was last written
+        self.colors = None
+        self.outline = None
+        self.order = {"slices": [], "sprites": []}
+
+        #id(image) -> (weakref to the image, record id, box)
+        self._images: Dict[int, tuple] = {}
+
+    def close(self) -> None:
+        """Close the session file."""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def resume(self, sheet: Image, cache: Optional[SpriteCache] = None) -> Optional[Snapshot]:
+        """Read the session file, returns the saved state or None to start afresh."""
+        digest = self.digest or file_digest(self.sheet)
+        state = self._read(digest) if self.path.exists() else None
+        if state is None:
+            self._open()
+            self._write({"type": "sheet", "path": str(self.sheet), "sha256": digest})
+            return None
+
+        colors, outline, items, order = state
+        slices = [items[number] for number in order["slices"]]
+        sprites = [items[number] for number in order["sprites"]]
+        slice_images = tuple(slice_sheet(sheet, Box(*item["box"])) for item in slices)
+
+        #one key set per distinct set of colors
+        shared = {}
+        def keys(value):
+            text = json.dumps(value)
+            if text not in shared:
+                shared[text] = keys_from_json(value)
+            return shared[text]
+        regions = [Region(Box(*item["box"]), keys(item["primary"]), keys(item["secondary"])) for item in sprites]
+        extracted = extract_regions(sheet, regions, cache)
+        sprites = [item for item, image in zip(sprites, extracted) if image is not None]
+        sprite_images = tuple(image for image in extracted if image is not None)
+
+        #remember the images, so the session keeps appending where it left off
+        for item, image in zip(slices + sprites, slice_images + sprite_images):
+            if image is not None:
+                self._register(image, item["id"], Box(*item["box"]))
+        self.next_id = max(items, default=-1) + 1
+        self.colors = colors
+        self.outline = outline
+        self.order = {
+            "slices": [item["id"] for item in slices],
+            "sprites": [item["id"] for item in sprites]}
+
+        #rewrite the file when most of it is superseded
+        live = len(slices) + len(sprites) + 4
+        if self.records > 2 * live + 100:
+            self._compact(digest, items)
+        else:
+            self._open()
+        return Snapshot(outline, colors, slice_images, sprite_images)
+
+    def add_slice(self, image: Image, box: Box) -> None:
+        """Save the box a slice was cut from."""
+        number = self._new_id(image, box)
+        self._write({"type": "slice", "id": number, "box": list(box)})
+
+    def add_sprite(self, image: Image, box: Optional[Box], primary: KeySet, secondary: Optional[KeySet]) -> None:
+        """Save the box and keys a sprite was extracted with.
+
+            A sprite without a box can't be extracted again on resume, so it
+            is left out of the session.
+        """
+        if box is None:
+            print("The sprite's slice has no box, it won't be in the resumed session.")
+            return
+        number = self._new_id(image, box)
+        self._write({
+            "type": "sprite",
+            "id": number,
+            "box": list(box),
+            "primary": keys_to_json(primary),
+            "secondary": keys_to_json(secondary)})
+
+    def alias(self, image: Image, packed) -> None:
+        """Let packed stand in for image, which it was packed from."""
+        entry = self._images.get(id(image))
+        if entry is not None and entry[0]() is image:
+            self._register(packed, entry[1], entry[2])
+
+    def box(self, image: Image) -> Optional[Box]:
+        """Return the box the slice or sprite came from."""
+        entry = self._images.get(id(image))
+        if entry is None or entry[0]() is not image:
+            return None
+        return entry[2]
+
+    def save(self, snapshot: Snapshot) -> None:
+        """Append whatever changed since the last save."""
+        if snapshot.colors != self.colors:
+            self.colors = snapshot.colors
+            self._write({"type": "colors", "colors": snapshot.colors})
+        if snapshot.outline != self.outline:
+            self.outline = snapshot.outline
+            self._write({"type": "outline", "coords": snapshot.outline})
+        self._save_order("slices", snapshot.slices)
+        self._save_order("sprites", snapshot.sprites)
+
+    def _compact(self, digest: str, items: Dict[int, dict]) -> None:
+        """Rewrite the session file with only the current state."""
+        temporary = self.path.with_suffix(".tmp")
+        self.file = open(temporary, "w")
+        self._write({"type": "sheet", "path": str(self.sheet), "sha256": digest})
+        self._write({"type": "colors", "colors": self.colors})
+        self._write({"type": "outline", "coords": self.outline})
+        for kind in ("slices", "sprites"):
+            for number in self.order[kind]:
+                self._write(items[number])
+            self._write({"type": kind, "ids": self.order[kind]})
+        self.file.close()
+        temporary.replace(self.path)
+        self._open()
+
+    def _new_id(self, image: Image, box: Box) -> int:
+        """Give the image the next record id."""
+        number = self.next_id
+        self.next_id += 1
+        self._register(image, number, box)
+        return number
+
+    def _open(self) -> None:
+        """Open the session file for appending."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(self.path, "a")
+
+    def _read(self, digest: str) -> Optional[tuple]:
+        """Replay the records after the last sheet record.
+
+            Returns None if the file is for a different sheet or a changed one.
+        """
+        colors = outline = None
+        items = {}
+        order = {"slices": [], "sprites": []}
+        header = None
+        with open(self.path) as source:
+            for line in source:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    #a write cut short when the program stopped
+                    continue
+                self.records += 1
+                kind = record["type"]
+                if kind == "sheet":
+                    header = record
+                    colors = outline = None
+                    items = {}
+                    order = {"slices": [], "sprites": []}
+                elif kind == "colors":
+                    colors = record["colors"]
+                elif kind == "outline":
+                    outline = record["coords"]
+                elif kind in ("slice", "sprite"):
+                    items[record["id"]] = record
+                elif "ids" in record:
+                    order[kind] = record["ids"]
+                else:
+                    order[kind] += record["append"]
+
+        if header is None or header["sha256"] != digest:
+            print(f"{self.path} is for another version of the sheet, starting a new session.")
+            return None
+        if colors is not None:
+            p_color, p_extra, s_color, s_extra, tolerance = colors
+            colors = (tuple(p_color), tuple(map(tuple, p_extra)), tuple(s_color), tuple(map(tuple, s_extra)), tolerance)
+        if outline is not None:
+            outline = tuple(Point(*point) for point in outline)
+        return colors, outline, items, order
+
+    def _register(self, image: Image, number: int, box: Box) -> None:
+        """Remember the image's record id and box."""
+        self._images[id(image)] = (weakref.ref(image), number, box)
+
+    def _save_order(self, kind: str, images: Tuple[Image, ...]) -> None:
+        """Append the slice or sprite order if it changed."""
+        ids = [self._id(image) for image in images]
+        ids = [number for number in ids if number is not None]
+        saved = self.order[kind]
+        if ids == saved:
+            return
+        if ids[:len(saved)] == saved:
+            self._write({"type": kind, "append": ids[len(saved):]})
+        else:
+            self._write({"type": kind, "ids": ids})
+        self.order[kind] = ids
+
+    def _id(self, image: Image) -> Optional[int]:
+        """Return the image's record id, None if it was never saved."""
+        entry = self._images.get(id(image))
+        if entry is None or entry[0]() is not image:
+            return None
+        return entry[1]
+
+    def _write(self, record: dict) -> None:
+        """Append one record and flush it to the OS."""
+        self.file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self.file.flush()
@@ -0,0 +1,13 @@
+#3rd party
+from PIL import Image
+import pyglet
+
+
+def image_data(image: Image) -> pyglet.image.ImageData:
+    """Wrap the image's RGBA pixels for pyglet without going through a file."""
+    if image.mode != "RGBA":
+        image = image.convert("RGBA")
+    data = image.tobytes()
+    #negative pitch: PIL stores the top row first, pyglet expects the bottom row first
+    pitch = -image.width * 4
+    return pyglet.image.ImageData(image.width, image.height, "RGBA", data, pitch=pitch)
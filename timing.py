@@ -0,0 +1,89 @@
+"""Time the key actions and frames, and keep rolling percentiles of them.
+
+    Timing is off until it is switched on. While it is off, measure() hands
+    back one shared do-nothing context manager, so the hooks cost a method
+    call and an attribute check.
+"""
+
+#std lib
+from collections import deque
+from contextlib import nullcontext
+import csv
+import json
+from pathlib import Path
+from time import perf_counter
+from typing import Dict, List, Tuple
+
+_OFF = nullcontext()
+
+
+class _Timer():
+    """Adds the time spent inside the with block to the timings."""
+    def __init__(self, timings, name: str):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.timings.add(self.name, self.start, perf_counter() - self.start)
+
+
+class Timings():
+    """The last window durations of each named action, and a trace of all of them."""
+    def __init__(self, window: int = 256, trace_length: int = 10000):
+        self.enabled = False
+        self.window = window
+        self.samples: Dict[str, deque] = {}
+        self.counts: Dict[str, int] = {}
+        self.trace = deque(maxlen=trace_length)
+
+    def measure(self, name: str):
+        """Return a context manager that times its block under name."""
+        if not self.enabled:
+            return _OFF
+        return _Timer(self, name)
+
+    def add(self, name: str, start: float, duration: float) -> None:
+        """Record one duration."""
+        if name not in self.samples:
+            self.samples[name] = deque(maxlen=self.window)
+            self.counts[name] = 0
+        self.samples[name].append(duration)
+        self.counts[name] += 1
+        self.trace.append((name, start, duration))
+
+    def toggle(self) -> bool:
+        """Switch timing on or off, returns True if it is now on."""
+        self.enabled = not self.enabled
+        return self.enabled
+
+    def percentiles(self, name: str) -> Tuple[float, float, float]:
+        """Return the 50th, 90th and 99th percentile of the recent durations."""
+        ordered = sorted(self.samples[name])
+        last = len(ordered) - 1
+        return tuple(ordered[round(last * share)] for share in (0.5, 0.9, 0.99))
+
+    def summary(self) -> List[dict]:
+        """Return the count and percentiles of every action, slowest first."""
+        rows = []
+        for name in self.samples:
+            p50, p90, p99 = self.percentiles(name)
+            rows.append({"name": name, "count": self.counts[name], "p50": p50, "p90": p90, "p99": p99})
+        rows.sort(key=lambda row: -row["p90"])
+        return rows
+
+    def export(self, path: Path) -> None:
+        """Write the summary as JSON, or the trace as CSV if path ends in .csv."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if path.suffix == ".csv":
+            with open(path, "w", newline="") as output:
+                writer = csv.writer(output)
+                writer.writerow(["name", "start", "duration"])
+                writer.writerows(self.trace)
+        else:
+            with open(path, "w") as output:
+                json.dump({"summary": self.summary(), "trace": list(self.trace)}, output, indent=1)
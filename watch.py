@@ -0,0 +1,260 @@
+"""Keep the extracted sheets of a folder of sprite sheets up to date.
+
+    Usage:
+        python3 watch.py <folder> <output dir> [--manifests <dir>] [--interval 1] [--once]
+
+    Every sheet in the folder needs a manifest with the same name, in the
+    folder or in --manifests, in the format batch.py reads: sheet.png goes
+    with sheet.json or sheet.csv. Each sheet's sprites are packed into
+    <output dir>/<sheet>.png with its frames in <output dir>/<sheet>.json.
+
+    What was done is kept in <output dir>/watch.state. A sheet is only read
+    again when its file or its manifest changed size or time, and only
+    rebuilt when its bytes changed. Sprites are cached by the pixels and
+    colors of their region, so only the regions whose pixels changed are
+    extracted again, and an output sheet is only written again when one of
+    its sprites changed. Cached sprites no sheet uses anymore are deleted.
+"""
+
+#std lib
+import argparse
+import hashlib
+import json
+from pathlib import Path
+import sys
+from time import perf_counter, sleep
+from typing import Dict, List, Optional
+
+#3rd party
+import numpy
+from PIL import Image
+
+#custom
+from atlas import write_atlas
+from batch import load_grid, load_manifest
+from cache import EMPTY, SpriteCache, file_digest
+from constants import Region
+from grid import grid_boxes
+from masks import key_set
+from pipeline import extract_regions
+from writer import PRESETS
+
+SHEET_SUFFIXES = (".png", ".gif", ".bmp")
+
+
+def region_key(pixels: numpy.ndarray, palette: Optional[bytes], region: Region) -> str:
+    """Return a key made from the region's pixels and colors, wherever the region is on whichever sheet."""
+    box = region.box
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{box.x2 - box.x1}x{box.y2 - box.y1}|{key_set(region.primary).keys}|".encode())
+    if region.secondary is not None:
+        digest.update(str(key_set(region.secondary).keys).encode())
+    if palette is not None:
+        digest.update(palette)
+    digest.update(numpy.ascontiguousarray(pixels[max(box.y1, 0):box.y2, max(box.x1, 0):box.x2]).data)
+    return digest.hexdigest()
+
+
+def _stat(path: Path) -> List[int]:
+    """Return the file's size and modification time."""
+    stat = path.stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _stats(sheet: Path, manifest: Optional[Path]) -> Optional[List[List[int]]]:
+    """Return the sheet's and the manifest's stats, None if either is gone."""
+    if manifest is None:
+        return None
+    try:
+        return [_stat(sheet), _stat(manifest)]
+    except FileNotFoundError:
+        return None
+
+
+class Watcher():
+    """The sheets of a folder, their manifests and what was last built from them."""
+    def __init__(self,
+                 folder: Path,
+                 output: Path,
+                 manifests: Optional[Path] = None,
+                 cache: Optional[Path] = None,
+                 preset: str = "default"):
+        self.folder = Path(folder)
+        self.output = Path(output)
+        self.manifests = Path(manifests) if manifests is not None else self.folder
+        self.preset = preset
+        #not .json or .png, so no sheet's output can have its name
+        self.state_path = self.output / "watch.state"
+        self.sheets: Dict[str, dict] = self._load_state()
+        self.touched = False
+        #keyed by region_key(), so the digest the cache was made for doesn't matter
+        self.cache = SpriteCache("regions", directory=cache if cache is not None else self.output / "cache")
+
+    def manifest(self, sheet: Path) -> Optional[Path]:
+        """Return the sheet's manifest, None if it has none."""
+        for suffix in (".json", ".csv"):
+            path = self.manifests / f"{sheet.stem}{suffix}"
+            if path.exists():
+                return path
+        return None
+
+    def scan(self) -> List[Path]:
+        """Return the sheets whose file or manifest changed since they were last built."""
+        changed = []
+        seen = set()
+        for sheet in sorted(self.folder.iterdir()):
+            if sheet.suffix.lower() not in SHEET_SUFFIXES:
+                continue
+            manifest = self.manifest(sheet)
+            stats = _stats(sheet, manifest)
+            if stats is None:
+                continue
+            seen.add(sheet.name)
+            state = self.sheets.get(sheet.name)
+            if state is None:
+                changed.append(sheet)
+                continue
+            if state["stats"] == stats:
+                continue
+            #touched, but maybe not changed
+            try:
+                digests = [file_digest(sheet), file_digest(manifest)]
+            except FileNotFoundError:
+                #deleted since the stat, it is seen as gone on the next scan
+                continue
+            if state["digests"] == digests:
+                state["stats"] = stats
+                self.touched = True
+            else:
+                changed.append(sheet)
+
+        for name in list(self.sheets):
+            if name not in seen:
+                print(f"{name} is gone, its output is left as it is.")
+                del self.sheets[name]
+                self.touched = True
+        return changed
+
+    def regions(self, sheet: Image, manifest: Path) -> List[Region]:
+        """Return the manifest's regions, the grid's cells included."""
+        regions = load_manifest(manifest)
+        grid = load_grid(manifest, sheet.size)
+        if grid is not None:
+            grid, primary, secondary = grid
+            regions += [Region(box, primary, secondary) for box in grid_boxes(grid)]
+        return regions
+
+    def rebuild(self, path: Path) -> bool:
+        """Extract the sheet's changed regions, returns True if its output sheet was written."""
+        manifest = self.manifest(path)
+        with Image.open(path) as image:
+            image.load()
+            sheet = image if image.mode in ("P", "RGBA") else image.convert("RGBA")
+        regions = self.regions(sheet, manifest)
+
+        pixels = numpy.asarray(sheet)
+        palette = bytes(sheet.getpalette()) if sheet.mode == "P" else None
+        keys = [region_key(pixels, palette, region) for region in regions]
+
+        found = [self.cache.get(key) for key in keys]
+        missing = [index for index, sprite in enumerate(found) if sprite is None]
+        for index, sprite in zip(missing, extract_regions(sheet, [regions[index] for index in missing])):
+            self.cache.put(keys[index], sprite)
+            found[index] = sprite
+
+        state = self.sheets.get(path.name)
+        output = self.output / f"{path.stem}.png"
+        self.sheets[path.name] = {
+            "stats": [_stat(path), _stat(manifest)],
+            "digests": [file_digest(path), file_digest(manifest)],
+            "regions": keys}
+        if state is not None and state.get("regions") == keys and output.exists():
+            print(f"{path.name}: no sprites changed")
+            return False
+
+        sprites = [sprite for sprite in found if sprite is not None and sprite is not EMPTY]
+        print(f"{path.name}: extracted {len(missing)} of {len(regions)} regions")
+        if not sprites:
+            print(f"{path.name}: there are no images to save.")
+            return False
+        write_atlas(sprites, output, self.preset)
+        return True
+
+    def update(self) -> int:
+        """Rebuild every changed sheet, returns how many output sheets were written."""
+        written = 0
+        try:
+            changed = self.scan()
+        except OSError as error:
+            #the folder itself is gone or unreadable, look again next time
+            print(f"Can't read {self.folder}: {error!r}")
+            return 0
+        for sheet in changed:
+            start = perf_counter()
+            try:
+                written += self.rebuild(sheet)
+            except Exception as error:
+                #a half saved sheet or a broken manifest, try again on the next change
+                print(f"{sheet.name} failed: {error!r}")
+                stats = _stats(sheet, self.manifest(sheet))
+                if stats is None:
+                    self.sheets.pop(sheet.name, None)
+                else:
+                    self.sheets[sheet.name] = {"stats": stats, "digests": []}
+                continue
+            print(f"{sheet.name}: done in {perf_counter() - start:.3f}s")
+        if changed or self.touched:
+            used = {key for state in self.sheets.values() for key in state.get("regions", [])}
+            deleted = self.cache.keep(used)
+            if deleted:
+                print(f"Deleted {deleted} cached sprites no sheet uses.")
+            self._save_state()
+            self.touched = False
+        return written
+
+    def _load_state(self) -> Dict[str, dict]:
+        """Return what was built last time, by sheet name."""
+        if not self.state_path.exists():
+            return {}
+        with open(self.state_path) as state:
+            return json.load(state)["sheets"]
+
+    def _save_state(self) -> None:
+        """Write down what was built, then rename, so a half written file is never read."""
+        self.output.mkdir(parents=True, exist_ok=True)
+        temporary = self.state_path.with_suffix(".tmp")
+        with open(temporary, "w") as state:
+            json.dump({"sheets": self.sheets}, state)
+        temporary.replace(self.state_path)
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="Keep the extracted sheets of a folder up to date.")
+    parser.add_argument("folder", type=Path, help="folder of sprite sheets")
+    parser.add_argument("output", type=Path, help="where to write the extracted sheets")
+    parser.add_argument("--manifests", type=Path, help="folder of manifests, defaults to the sheets' folder")
+    parser.add_argument("--cache", type=Path, help="directory to keep extracted sprites in, defaults to <output>/cache")
+    parser.add_argument("--png", choices=sorted(PRESETS), default="default", help="PNG speed versus size")
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between looks at the folder")
+    parser.add_argument("--once", action="store_true", help="bring the outputs up to date and stop")
+    args = parser.parse_args(argv)
+
+    watcher = Watcher(args.folder, args.output, args.manifests, args.cache, args.png)
+    start = perf_counter()
+    written = watcher.update()
+    print(f"{written} sheets written in {perf_counter() - start:.3f}s")
+    if args.once:
+        return 0
+
+    print(f"Watching {args.folder}, ctrl+c to stop.")
+    try:
+        while True:
+            sleep(args.interval)
+            watcher.update()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
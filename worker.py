@@ -0,0 +1,111 @@
+"""Run slow jobs on background threads and hand their results back to the main thread.
+
+    Extraction and PNG encoding spend their time in numpy and Pillow, which
+    let go of the GIL, so threads keep the window responsive without copying
+    images between processes. pyglet's clock is not safe to schedule on from
+    another thread, so finished jobs wait in a queue until the main thread
+    calls poll().
+"""
+
+#std lib
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty, Queue
+import threading
+from typing import Any, Callable, List, Optional
+
+
+class Cancelled(Exception):
+    """Raised inside a job that was cancelled."""
+
+
+class Job():
+    """A job's progress and its cancel flag, shared with the thread running it."""
+    def __init__(self, name: str, total: int = 1):
+        self.name = name
+        self.total = total
+        self.done = 0
+        self._cancelled = threading.Event()
+
+    def __str__(self) -> str:
+        if self.total > 1:
+            return f"{self.name} {self.done}/{self.total}"
+        return self.name
+
+    def advance(self, amount: int = 1) -> None:
+        """Count finished work, raises Cancelled if the job was cancelled."""
+        self.check()
+        self.done += amount
+
+    def cancel(self) -> None:
+        """Ask the job to stop at its next check."""
+        self._cancelled.set()
+
+    def cancelled(self) -> bool:
+        """Return True if the job was cancelled."""
+        return self._cancelled.is_set()
+
+    def check(self) -> None:
+        """Raise Cancelled if the job was cancelled."""
+        if self._cancelled.is_set():
+            raise Cancelled()
+
+
+class Worker():
+    """A thread pool whose results are collected by poll() on the main thread."""
+    def __init__(self, threads: int = 2, notify: Optional[Callable[[], None]] = None):
+        self.pool = ThreadPoolExecutor(max_workers=threads)
+        self.notify = notify
+        self.jobs: List[Job] = []
+        self.finished = Queue()
+
+    def busy(self) -> bool:
+        """Return True if some jobs have not been collected yet."""
+        return bool(self.jobs)
+
+    def submit(self, job: Job, function: Callable[[Job], Any], on_done: Callable[[Any], None]) -> Job:
+        """Run function(job) on a thread, on_done(result) is called by poll()."""
+        self.jobs.append(job)
+        self.pool.submit(self._run, job, function, on_done)
+        return job
+
+    def cancel(self) -> None:
+        """Cancel every job that is running or waiting."""
+        for job in self.jobs:
+            job.cancel()
+
+    def poll(self) -> bool:
+        """Call on_done for the finished jobs, returns True if any finished."""
+        finished = False
+        while True:
+            try:
+                job, result, error, on_done = self.finished.get_nowait()
+            except Empty:
+                return finished
+            finished = True
+            self.jobs.remove(job)
+            if isinstance(error, Cancelled) or job.cancelled():
+                print(f"{job.name} cancelled.")
+            elif error is not None:
+                print(f"{job.name} failed: {error!r}")
+            else:
+                try:
+                    on_done(result)
+                except Exception as exception:
+                    print(f"{job.name} failed: {exception!r}")
+
+    def shutdown(self) -> None:
+        """Cancel the jobs and stop the threads."""
+        self.cancel()
+        self.pool.shutdown(wait=False)
+
+    def _run(self, job: Job, function: Callable[[Job], Any], on_done: Callable[[Any], None]) -> None:
+        """Run the job and queue its result."""
+        result = error = None
+        try:
+            job.check()
+            result = function(job)
+        except Exception as exception:
+            error = exception
+        self.finished.put((job, result, error, on_done))
+        if self.notify is not None:
+            self.notify()
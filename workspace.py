@@ -1,13 +1,24 @@
 #std lib
+from collections import OrderedDict
+from pathlib import Path
 import sys
-from typing import List, Tuple
+import threading
+from typing import List, Optional, Tuple
 
 #3rd party
 from PIL import Image
 import pyglet
+from pyglet.gl import GL_NEAREST, GL_TEXTURE_MAG_FILTER, GL_TEXTURE_MIN_FILTER, glBindTexture, glTexParameteri
 
 #custom
-from constants import Box, Point, Pixel
+from cache import SpriteCache, file_digest
+from colors import ColorSuggester
+from constants import Box, Color, Point, Pixel, Region
+from detect import detect_sprites
+from grid import Grid, extract_grid, grid_from_cell
+from masks import IntegralMask, KeySet, primary_mask
+from pipeline import extract_regions, load_sheet, slice_sheet
+from textures import image_data
 
 
 class Outline():
@@ -15,6 +26,7 @@ class Outline():
         self.primary_ref = 0
         self.secondary_ref = 0
         self.color = (255, 0, 0)
+        self.snap_color = (0, 255, 0)
         self.line_width = 3
 
         #reference image
@@ -66,6 +78,12 @@ class Outline():
             color=self.color,
             batch=self.batch)
 
+        #the tight box around what is inside the outline, kept up while dragging
+        self.snap_lines = [
+            pyglet.shapes.Line(0, 0, 0, 0, width=1, color=self.snap_color, batch=self.batch)
+            for _ in range(4)]
+        self._unsnap()
+
     def __str__(self) -> None:
         return str(f"ref: A={self.a} B={self.b} w={self.width} h={self.height}, sheet: A={self.sheet_a} B={self.sheet_b} w={self.sheet_w} h={self.sheet_h}")
 
@@ -106,6 +124,27 @@ class Outline():
             self.sheet_b.x,
             self.sheet_b.y)
 
+    def _snap(self, a: Point, b: Point) -> None:
+        """Show the snapped box between corners a and b, in workspace coordinates."""
+        top, bottom, left, right = self.snap_lines
+        top.position = (a.x, a.y, b.x, a.y)
+        bottom.position = (a.x, b.y, b.x, b.y)
+        left.position = (a.x, a.y, a.x, b.y)
+        right.position = (b.x, a.y, b.x, b.y)
+        for line in self.snap_lines:
+            line.visible = True
+
+    def _shift_snap(self, dx: int, dy: int) -> None:
+        """Move the snapped box with the outline."""
+        for line in self.snap_lines:
+            x, y, x2, y2 = line.position
+            line.position = (x + dx, y + dy, x2 + dx, y2 + dy)
+
+    def _unsnap(self) -> None:
+        """Hide the snapped box."""
+        for line in self.snap_lines:
+            line.visible = False
+
     def _start(self, coord: Point)-> None:
         """Set the outline's starting point."""
         self.a = coord
@@ -142,6 +181,7 @@ class Outline():
         #change the outline's boundaries
         self._sheet_start(new_a)
         self._sheet_end(new_b)
+        self._shift_snap(0, -amount)
 
     def _move_left(self, amount: int) -> None:
         """Move the outline on the workspace spritesheet to the left by amount."""
@@ -155,6 +195,7 @@ class Outline():
         #change the outline's boundaries
         self._sheet_start(new_a)
         self._sheet_end(new_b)
+        self._shift_snap(-amount, 0)
 
     def _move_right(self, amount: int) -> None:
         """Move the outline on the workspace spritesheet to the right by amount."""
@@ -168,6 +209,7 @@ class Outline():
         #change the outline's boundaries
         self._sheet_start(new_a)
         self._sheet_end(new_b)
+        self._shift_snap(amount, 0)
 
     def _move_up(self, amount: int) -> None:
         """Move the outline on the workspace spritesheet to the up by amount."""
@@ -181,41 +223,25 @@ class Outline():
         #change the outline's boundaries
         self._sheet_start(new_a)
         self._sheet_end(new_b)
+        self._shift_snap(0, amount)
 
-    def _zoom_in(self, zoom: int, movement: int) -> None:
-        """Enlarge the outline's boundaries to match the zoom amount"""
-        #get reference images' a and b, then apply scale to that to calculate the coordinate
-        ref_a = self.a
-        ref_b = self.b
-
-        #apply scaling factor to each point
-        new_a = Point(ref_a.x * zoom, ref_a.y * zoom)
-        new_b = Point(ref_b.x * zoom, ref_b.y * zoom)
+    def _zoom(self, factor: float, translation: Tuple[int, int]) -> None:
+        """Keep the outline on the same sheet pixels after the sheet's scale changed by factor."""
+        #the reference coordinates are the sheet's pixels times its scale, like _slice_box() reads them
+        self.a = Point(self.a.x * factor, self.a.y * factor)
+        self.b = Point(self.b.x * factor, self.b.y * factor)
 
         #change the outline's boundaries
-        self._sheet_start(new_a)
-        self._sheet_end(new_b)
-
-    #TODO
-    def _zoom_out(self, zoom: int, movement: int) -> None:
-        """Shrink the outline's boundaries to match the zoom amount"""
-        #get reference images' a and b, then apply scale to that to calculate the coordinate
-        ref_a = self.a
-        ref_b = self.b
-
-        #apply scaling factor to each point
-        new_a = Point(ref_a.x // zoom, ref_a.y // zoom)
-        new_b = Point(ref_b.x // zoom, ref_b.y // zoom)
-
-        #change the outline's boundaries
-        self._sheet_start(new_a)
-        self._sheet_end(new_b)
+        self._sheet_start(Point(self.a.x + translation[0], self.a.y + translation[1]))
+        self._sheet_end(Point(self.b.x + translation[0], self.b.y + translation[1]))
+        self._unsnap()
 
     def reset(self) -> None:
         self.a = Point(0, 0)
         self.b = Point(0, 0)
         self.sheet_a = Point(0, 0)
         self.sheet_b = Point(0, 0)
+        self._unsnap()
 
     def update(self) -> None:
         self._dimensions()
@@ -223,28 +249,196 @@ class Outline():
         self.batch.draw()
 
 
+class TiledSheet():
+    """Draw a sheet of any size from fixed-size tiles.
+
+        Only the tiles in view are uploaded. Zoomed out views draw from a
+        pyramid of half-size copies of the sheet, built on a thread while the
+        closest level already built is drawn. The least recently drawn tiles
+        are dropped once the cache is full.
+    """
+    def __init__(self, image: Image, tile_size: int = 512, cache_size: int = 64):
+        self.x = 0
+        self.y = 0
+        self.scale = 1
+        self.tile_size = tile_size
+        self.cache_size = cache_size
+        self.uploads_per_frame = 8
+        self.levels = [image]
+        self.building = None
+        self.tiles = OrderedDict()
+
+    def _level(self) -> int:
+        """Return the pyramid level whose pixels are closest to one screen pixel."""
+        level = 0
+        scale = self.scale
+        width, height = self.levels[0].size
+        while scale < 1 and max(width, height) > self.tile_size:
+            scale *= 2
+            level += 1
+            #reduce() rounds up
+            width, height = -(-width // 2), -(-height // 2)
+        return level
+
+    def _build_levels(self, level: int) -> None:
+        """Build the pyramid down to level on a thread, if it isn't being built already."""
+        if self.building is not None and self.building.is_alive():
+            return
+
+        def build() -> None:
+            while len(self.levels) <= level:
+                image = self.levels[-1]
+                if image.mode == "P":
+                    #palette indices can't be averaged
+                    image = image.convert("RGBA")
+                self.levels.append(image.reduce(2))
+
+        self.building = threading.Thread(target=build, daemon=True)
+        self.building.start()
+
+    def _level_image(self, level: int) -> Image:
+        """Return the sheet at 1 / 2**level of its size."""
+        return self.levels[level]
+
+    def _texture(self, key: Tuple[int, int, int]) -> pyglet.image.Texture:
+        """Return the tile's texture, uploading it if it is not cached."""
+        texture = self.tiles.get(key)
+        if texture is not None:
+            self.tiles.move_to_end(key)
+            return texture
+
+        level, column, row = key
+        size = self.tile_size
+        image = self._level_image(level)
+        tile = image.crop((
+            column * size,
+            row * size,
+            min((column + 1) * size, image.width),
+            min((row + 1) * size, image.height)))
+        texture = image_data(tile).get_texture()
+
+        #keep the pixels sharp when zoomed in
+        glBindTexture(texture.target, texture.id)
+        glTexParameteri(texture.target, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+        glTexParameteri(texture.target, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+
+        self.tiles[key] = texture
+        while len(self.tiles) > self.cache_size:
+            self.tiles.popitem(last=False)
+        return texture
+
+    def draw(self, width: int, height: int) -> bool:
+        """Draw the tiles inside a width x height window.
+
+            Returns True if some tiles were left for the next frame because
+            of the upload limit.
+        """
+        level = self._level()
+        building = level >= len(self.levels)
+        if building:
+            self._build_levels(level)
+            level = len(self.levels) - 1
+        image = self._level_image(level)
+        size = self.tile_size
+
+        #screen pixels per level pixel
+        x_step = self.scale * self.levels[0].width / image.width
+        y_step = self.scale * self.levels[0].height / image.height
+
+        #visible part of the level image, PIL's top-left origin
+        left = max(0, int((0 - self.x) / x_step))
+        right = min(image.width, int((width - self.x) / x_step) + 1)
+        top = max(0, int(image.height - (height - self.y) / y_step))
+        bottom = min(image.height, int(image.height - (0 - self.y) / y_step) + 1)
+        if left >= right or top >= bottom:
+            return building
+
+        uploads = 0
+        pending = building
+        for row in range(top // size, (bottom - 1) // size + 1):
+            for column in range(left // size, (right - 1) // size + 1):
+                key = (level, column, row)
+                if key not in self.tiles:
+                    if uploads >= self.uploads_per_frame:
+                        pending = True
+                        continue
+                    uploads += 1
+                texture = self._texture(key)
+                tile_bottom = min((row + 1) * size, image.height)
+                texture.blit(
+                    self.x + column * size * x_step,
+                    self.y + (image.height - tile_bottom) * y_step,
+                    width=texture.width * x_step,
+                    height=texture.height * y_step)
+        return pending
+
+
 class SpriteSheet():
-    def __init__(self, img):
-        self.image = pyglet.image.load(img) #for ease of coordinate system use, redundant?
-        self.reference_image = Image.open(img)
-        self.sheet = pyglet.resource.image(img)
-        self.seq = pyglet.image.ImageGrid(self.sheet, 1, 1)
-        self.anim = pyglet.image.Animation.from_image_sequence(self.seq, 0.2, True)
-        self.batch = pyglet.graphics.Batch()
-        self.sprite_sheet = pyglet.sprite.Sprite(self.anim, batch=self.batch)
+    def __init__(self, img, cache_dir: Optional[Path] = None):
+        #decode once, the tiles are cropped from the reference image as they come into view
+        self.reference_image = load_sheet(img)
+        self.digest = file_digest(img)
+        #in memory only, unless a directory is given to keep sprites between runs
+        self.cache = SpriteCache(self.digest, directory=cache_dir)
+        self.sprite_sheet = TiledSheet(self.reference_image)
+        self.suggester = None
+        self.integral = None
+        self.integral_keys = None
+        self.scales = (0.125, 0.25, 0.5, 1, 2, 3, 4, 5, 6)
         self.translation_speed = 100
 
     def _coords(self) -> Tuple[int, int]:
         """Return sprite sheet's origin coordinates."""
         return (self.sprite_sheet.x, self.sprite_sheet.y)
 
-    def _crop_boundaries(self, mask) -> Box:
-        """Return the boundaries for the crop box."""
-        top = self._top_row(mask)
-        bottom = self._bottom_row(mask)
-        left = self._left_column(mask)
-        right = self._right_column(mask)
-        return Box(left, top, right, bottom)
+    def _detect(self, background: KeySet, gap: int, min_area: int) -> List[Box]:
+        """Return one box per sprite on the reference image."""
+        return detect_sprites(self.reference_image, background, gap, min_area)
+
+    def _extract_grid(self, grid: Grid, primary: KeySet, secondary: KeySet, band: Optional[Box] = None) -> List[Image]:
+        """Return the extracted sprite of every cell of the grid, None for empty cells.
+
+            With a band, the grid is placed relative to the band's box.
+        """
+        sheet = self.reference_image if band is None else self.reference_image.crop(band)
+        return extract_grid(sheet, grid, primary, secondary)
+
+    def _integral(self, keys: KeySet) -> IntegralMask:
+        """Return the summed-area table of the sheet's non-primary pixels."""
+        return IntegralMask(primary_mask(self.reference_image, keys))
+
+    def _set_integral(self, keys: KeySet, integral: IntegralMask) -> None:
+        """Keep the summed-area table built for keys."""
+        self.integral, self.integral_keys = integral, keys
+
+    def _tight_box(self, coords: Tuple[Point, Point], keys: KeySet) -> Optional[Box]:
+        """Return the tight box around what is inside the outline, PIL's top-left origin.
+
+            Returns None while there is no table for keys or the outline is empty.
+        """
+        if self.integral is None or self.integral_keys != keys:
+            return None
+        box = self.integral.tight(self._slice_box(coords))
+        if box.x2 <= box.x1:
+            return None
+        return box
+
+    def _corners(self, box: Box) -> Tuple[Point, Point]:
+        """Return the box's corners in workspace coordinates."""
+        #back to the sheet's bottom-left origin, scaled and moved like the sheet
+        scale = self._scale()
+        x, y = self._coords()
+        height = self.reference_image.height
+        return (Point(box.x1 * scale + x, (height - box.y1) * scale + y),
+                Point(box.x2 * scale + x, (height - box.y2) * scale + y))
+
+    def _grid(self, coords: Tuple[Point, Point], spacing: int) -> Grid:
+        """Return the grid covering the sheet with cells like the outline."""
+        return grid_from_cell(self.reference_image.size, self._slice_box(coords), spacing)
+
+    def _extract(self, regions: List[Region]) -> List[Image]:
+        """Return the extracted sprites for each region of the reference image."""
+        return extract_regions(self.reference_image, regions, self.cache)
 
     def _move_up(self) -> None:
         """Translate the sprite sheet up."""
@@ -265,11 +459,14 @@ class SpriteSheet():
     def _pixel(self, pos: Point) -> Pixel:
         """Get pixel's coordinate and RGB data."""
         scale = self._scale()
-        coord = Point(pos.x // scale, pos.y // scale)
+        coord = Point(int(pos.x // scale), int(pos.y // scale))
         x = int(coord[0])
-        y = int(self.image.height - coord[1])
+        y = int(self.reference_image.height - coord[1])
         try:
             rgb = self.reference_image.getpixel((x, y))
+            if self.reference_image.mode == "P":
+                rgb = self.reference_image.getpalette()[rgb * 3:rgb * 3 + 3]
+            rgb = tuple(rgb[:3])
         except IndexError:
             rgb = (0, 0, 0)
         return coord, rgb
@@ -279,19 +476,21 @@ class SpriteSheet():
         return self.sprite_sheet.scale
 
     def _scale_down(self) -> None:
-        """Decrement the sprite sheet scale by 1."""
-        self.sprite_sheet.scale -= 1
-        if self.sprite_sheet.scale <= 1:
-            self.sprite_sheet.scale = 1
+        """Step the sprite sheet scale down, halving it below 1."""
+        index = self.scales.index(self.sprite_sheet.scale)
+        self.sprite_sheet.scale = self.scales[max(index - 1, 0)]
 
     def _scale_up(self) -> None:
-        """Increment the sprite sheet scale by 1."""
-        self.sprite_sheet.scale += 1
-        if self.sprite_sheet.scale >= 6:
-            self.sprite_sheet.scale = 6
+        """Step the sprite sheet scale up, by 1 above 1."""
+        index = self.scales.index(self.sprite_sheet.scale)
+        self.sprite_sheet.scale = self.scales[min(index + 1, len(self.scales) - 1)]
 
-    def _slice(self, coords: Tuple[Point, Point]) -> Image:
-        """Returns slice of the reference image."""
+    def _slice(self, box: Box) -> Image:
+        """Returns the box's slice of the reference image."""
+        return slice_sheet(self.reference_image, box)
+
+    def _slice_box(self, coords: Tuple[Point, Point]) -> Box:
+        """Returns the outline's box on the reference image, PIL's top-left origin."""
         image = self.reference_image
         scale = self._scale()
         sprite_a, sprite_b = coords[0], coords[1]
@@ -311,55 +510,44 @@ class SpriteSheet():
         #flip the y-axis because of PIL's coordinate system
         top = image.height - top
         bottom = image.height - bottom
-        return image.crop((left, bottom, right, top))
+
+        #keep the box on the sheet
+        left = min(max(round(left), 0), image.width)
+        right = min(max(round(right), 0), image.width)
+        bottom = min(max(round(bottom), 0), image.height)
+        top = min(max(round(top), 0), image.height)
+        return Box(left, bottom, right, top)
+
+    def _suggest(self, coords: Tuple[Point, Point]) -> Tuple[Color, Color, List[Color]]:
+        """Guess the primary and secondary colors for the outline, and list its edge colors."""
+        if self.suggester is None:
+            self.suggester = ColorSuggester(self.reference_image)
+        box = self._slice_box(coords)
+        found = self.suggester.border(box)
+        primary, secondary = self.suggester.suggest(box, found)
+        return primary, secondary, [color for color, _ in found]
 
     def _translation_speed(self) -> int:
         """Returns spritesheet translation speed."""
         return self.translation_speed
 
-    #BOUNDARIES
-    def _bottom_row(self, mask: List[List[bool]]) -> int:
-        """Find bottom row index of sprite box."""
-        mask.reverse()
-        for row in enumerate(mask):
-            if any(row[1]):
-                return len(mask) - row[0]
-
-    def _left_column(self, mask: List[List[bool]]) -> int:
-        """Find left column index of sprite box."""
-        row = self._top_row(mask)
-        for pixel in mask[row]:
-            if pixel == True:
-                return mask[row].index(pixel)
-
-    def _right_column(self, mask: List[List[bool]]) -> int:
-        """Find right column index of sprite box."""
-        row_index = self._top_row(mask)
-        row = mask[row_index]
-        row.reverse()
-        for pixel in row:
-            if pixel == True:
-                return len(row) - row.index(pixel)
-
-    def _top_row(self, mask: List[List[bool]]) -> int:
-        """Find top row index of sprite box."""
-        for row in enumerate(mask):
-            if any(row[1]):
-                return row[0]
-
     def reset(self) -> None:
         self.sprite_sheet.scale = 1
         self.sprite_sheet.x = 0
         self.sprite_sheet.y = 0
 
-    def update(self) -> None:
-        self.batch.draw()
+    def update(self, width: int, height: int) -> bool:
+        """Draw the sheet, returns True if it needs another frame to finish."""
+        return self.sprite_sheet.draw(width, height)
 
 
 class Workspace():
-    def __init__(self, img):
+    def __init__(self, img, cache_dir: Optional[Path] = None):
         self.outline = Outline()
-        self.sprites = SpriteSheet(img)
+        self.sprites = SpriteSheet(img, cache_dir)
+
+        #primary colors the outline was last snapped with
+        self.snap_keys = None
 
     def change_outline_end(self, ref_coord: Point) -> None:
         """Change the outline's ending point."""
@@ -381,9 +569,54 @@ class Workspace():
         sheet_coord = Point(ref_coord[0] + translation[0], ref_coord[1] + translation[1])
         self.outline._sheet_start(sheet_coord)
 
-    def crop_subsprite(self, mask) -> Box:
-        """Return a cropped image."""
-        return self.sprites._crop_boundaries(mask)
+    def detect(self, background: KeySet, gap: int, min_area: int) -> List[Box]:
+        """Return one box per sprite on the sheet."""
+        return self.sprites._detect(background, gap, min_area)
+
+    def extract_grid(self, grid: Grid, primary: KeySet, secondary: KeySet, band: Optional[Box] = None) -> List[Image]:
+        """Return the extracted sprite of every cell of the grid, placed relative to band if one is given."""
+        return self.sprites._extract_grid(grid, primary, secondary, band)
+
+    def integral(self, keys: KeySet) -> IntegralMask:
+        """Return the summed-area table of the sheet's non-primary pixels, slow on big sheets."""
+        return self.sprites._integral(keys)
+
+    def needs_integral(self, keys: KeySet) -> bool:
+        """Return True if there is no summed-area table for keys yet."""
+        return self.sprites.integral_keys != keys
+
+    def set_integral(self, keys: KeySet, integral: IntegralMask) -> None:
+        """Use the summed-area table built for keys to snap the outline."""
+        self.sprites._set_integral(keys, integral)
+
+    def selection_box(self, coords: Tuple[Point, Point], keys: KeySet) -> Box:
+        """Return the box the outline snaps to, or the outline's own box while it can't snap."""
+        box = self.sprites._tight_box(coords, keys)
+        if box is None:
+            return self.sprites._slice_box(coords)
+        return box
+
+    def snap_outline(self, keys: KeySet) -> None:
+        """Show the tight box around what is inside the outline."""
+        self.snap_keys = keys
+        box = self.sprites._tight_box(self.ref_img_coords(), keys)
+        if box is None:
+            self.outline._unsnap()
+        else:
+            self.outline._snap(*self.sprites._corners(box))
+
+    def grid(self, coords: Tuple[Point, Point], spacing: int) -> Grid:
+        """Return the grid covering the sheet with cells like the outline."""
+        return self.sprites._grid(coords, spacing)
+
+    def extract(self, regions: List[Region]) -> List[Image]:
+        """Return the extracted sprites for each region of the sheet."""
+        return self.sprites._extract(regions)
+
+    def restore_outline(self, coords: Tuple[Point, Point]) -> None:
+        """Put the outline back on ref_img_coords(), wherever the sheet is now."""
+        self.change_outline_start(coords[0])
+        self.change_outline_end(coords[1])
 
     def ref_img_coords(self) -> Tuple[Point, Point]:
         """Return the outline's A and B coordinates."""
@@ -425,31 +658,57 @@ class Workspace():
         """Return sprite sheet scale."""
         return self.sprites._scale()
 
-    def slice(self, coords: Tuple[Point, Point]) -> Image:
-        """Return a slice of the spritesheet."""
-        return self.sprites._slice(coords)
+    def cache(self) -> SpriteCache:
+        """Return the cache of extracted sprites."""
+        return self.sprites.cache
+
+    def sheet_digest(self) -> str:
+        """Return the sha256 of the sheet's file."""
+        return self.sprites.digest
+
+    def reference_image(self) -> Image:
+        """Return the decoded sprite sheet."""
+        return self.sprites.reference_image
+
+    def slice(self, coords: Tuple[Point, Point], keys: Optional[KeySet] = None) -> Image:
+        """Return a slice of the spritesheet, of the snapped box when keys are given."""
+        if keys is None:
+            return self.sprites._slice(self.sprites._slice_box(coords))
+        return self.sprites._slice(self.selection_box(coords, keys))
+
+    def slice_box(self, coords: Tuple[Point, Point]) -> Box:
+        """Return the outline's box on the sheet, PIL's top-left origin."""
+        return self.sprites._slice_box(coords)
+
+    def suggest_colors(self, coords: Tuple[Point, Point]) -> Tuple[Color, Color, List[Color]]:
+        """Guess the primary and secondary colors for the outline."""
+        return self.sprites._suggest(coords)
 
     def zoom_in(self) -> None:
         """Zoom in on the sprite sheet."""
-        #TODO
+        old = self.sheet_scale()
         self.sprites._scale_up()
-        scale = self.sheet_scale()
-        movement = self.sprites._translation_speed()
-        self.outline._zoom_in(scale, movement)
+        self._zoom_outline(old)
 
     def zoom_out(self) -> None:
         """Zoom out on the sprite sheet."""
-        #TODO
+        old = self.sheet_scale()
         self.sprites._scale_down()
-        scale = self.sheet_scale()
-        movement = self.sprites._translation_speed()
-        self.outline._zoom_out(scale, movement)
+        self._zoom_outline(old)
+
+    def _zoom_outline(self, old: float) -> None:
+        """Move the outline with the sheet after its scale changed from old."""
+        self.outline._zoom(self.sheet_scale() / old, self.sprites._coords())
+        if self.snap_keys is not None:
+            self.snap_outline(self.snap_keys)
 
     def reset(self) -> None:
         """Reset everything."""
         self.outline.reset()
         self.sprites.reset()
 
-    def update(self) -> None:
-        self.sprites.update()
+    def update(self, width: int, height: int) -> bool:
+        """Draw the workspace, returns True if it needs another frame to finish."""
+        pending = self.sprites.update(width, height)
         self.outline.update()
+        return pending
@@ -0,0 +1,133 @@
+"""Write PNGs with a choice between speed and size.
+
+    Presets:
+        fast     zlib level 1, several times quicker to write, bigger files
+        default  zlib level 6, Pillow's own default
+        max      zlib level 9 with optimize, smallest files, slowest
+
+    Independent files are encoded on a thread pool, Pillow lets go of the
+    GIL while it compresses. Sheets too big to hold twice are written band by
+    band, see write_bands().
+"""
+
+#std lib
+from concurrent.futures import ThreadPoolExecutor
+import os
+from pathlib import Path
+import struct
+from typing import Iterable, List, Optional, Tuple
+import zlib
+
+#3rd party
+import numpy
+from PIL import Image
+
+#custom
+from worker import Job
+
+PRESETS = {
+    "fast": {"compress_level": 1},
+    "default": {"compress_level": 6},
+    "max": {"compress_level": 9, "optimize": True}}
+
+
+def save_png(image: Image, path: Path, preset: str = "default", job: Optional[Job] = None) -> None:
+    """Save the image as a PNG with the preset's settings.
+
+        With a job, nothing is written if it was cancelled, and the save
+        counts as one step of it.
+    """
+    if preset not in PRESETS:
+        raise ValueError(f"Unknown PNG preset: {preset}, use one of {', '.join(PRESETS)}")
+    if job is not None:
+        job.check()
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    image.save(path, format="PNG", **PRESETS[preset])
+    if job is not None:
+        job.done += 1
+
+
+def save_many(images: List[Image], paths: List[Path], preset: str = "default", threads: int = None) -> None:
+    """Save every image to its path, several at a time."""
+    threads = threads or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        #list() so an error in any save is raised here
+        list(pool.map(lambda pair: save_png(pair[0], pair[1], preset), zip(images, paths)))
+
+
+def _chunk(kind: bytes, data: bytes) -> bytes:
+    """Return a PNG chunk: length, type, data and CRC."""
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def _filter(pixels: numpy.ndarray, previous: numpy.ndarray) -> numpy.ndarray:
+    """Return the rows with the Sub or the Up filter, whichever leaves the smaller values.
+
+        pixels is (rows, width * 4), previous is the row above the first one,
+        zeros for the top of the image. This is the heuristic the PNG spec
+        suggests, only over two of the five filters.
+    """
+    above = numpy.vstack((previous[None], pixels[:-1]))
+    up = pixels - above
+    sub = pixels.copy()
+    sub[:, 4:] -= pixels[:, :-4]
+    #smaller means closer to 0 either way, so score the bytes as signed
+    up_score = numpy.abs(up.view(numpy.int8).astype(numpy.int32)).sum(axis=1)
+    sub_score = numpy.abs(sub.view(numpy.int8).astype(numpy.int32)).sum(axis=1)
+    use_up = up_score < sub_score
+    filtered = numpy.empty((pixels.shape[0], pixels.shape[1] + 1), dtype=numpy.uint8)
+    #filter types: 1 is Sub, 2 is Up
+    filtered[:, 0] = numpy.where(use_up, 2, 1)
+    filtered[:, 1:] = numpy.where(use_up[:, None], up, sub)
+    return filtered
+
+
+def write_bands(path: Path,
+                size: Tuple[int, int],
+                bands: Iterable[Image],
+                preset: str = "default",
+                job: Optional[Job] = None) -> None:
+    """Write an RGBA PNG from horizontal bands, top to bottom.
+
+        Each band is filtered, compressed and written before the next one is
+        made, so only one band is ever in memory. The bands must be RGBA,
+        size[0] wide and add up to size[1] rows. Each row gets the Sub or Up
+        filter, where Pillow also tries the other three, and the max preset's
+        optimize is not used here, so some sheets come out a little bigger.
+        The file is written under a temporary name and only renamed into place
+        once it is complete. With a job, each band is a step of it and a
+        cancelled job stops before the file is renamed into place.
+    """
+    width, height = size
+    level = PRESETS[preset]["compress_level"]
+    compressor = zlib.compressobj(level)
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_suffix(".tmp")
+    try:
+        with open(temporary, "wb") as output:
+            output.write(b"\x89PNG\r\n\x1a\n")
+            #8 bits per channel, color type 6 is RGBA
+            output.write(_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)))
+            rows = 0
+            previous = numpy.zeros(width * 4, dtype=numpy.uint8)
+            for band in bands:
+                pixels = numpy.asarray(band).reshape(band.height, width * 4)
+                rows += band.height
+                if rows > height:
+                    raise ValueError(f"The bands have more than {height} rows")
+                data = compressor.compress(_filter(pixels, previous).tobytes())
+                if data:
+                    output.write(_chunk(b"IDAT", data))
+                previous = pixels[-1]
+                if job is not None:
+                    job.advance()
+            if rows != height:
+                raise ValueError(f"The bands had {rows} rows, expected {height}")
+            output.write(_chunk(b"IDAT", compressor.flush()))
+            output.write(_chunk(b"IEND", b""))
+        temporary.replace(path)
+    finally:
+        if temporary.exists():
+            temporary.unlink()